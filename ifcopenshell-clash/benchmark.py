@@ -0,0 +1,178 @@
+import click
+import json
+import logging
+import math
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import ifcopenshell
+import ifcopenshell.api.aggregate
+import ifcopenshell.api.context
+import ifcopenshell.api.geometry
+import ifcopenshell.api.project
+import ifcopenshell.api.root
+import ifcopenshell.api.spatial
+import ifcopenshell.api.unit
+
+sys.path.insert(0, str(Path(__file__).parent / 'ifcclash'))
+from ifcclash.ifcclash import Clasher, ClashSettings  # noqa: E402
+
+WALL_HEIGHT = 3.0
+WALL_THICKNESS = 0.2
+MODES = {
+    'intersection': {'tolerance': 0.002, 'check_all': True},
+    'collision': {'allow_touching': False},
+    'clearance': {'clearance': 0.1, 'check_all': True},
+}
+PHASES = ['load', 'selection', 'tessellation', 'tree', 'clash', 'results', 'export']
+
+
+def create_model():
+    ifc = ifcopenshell.api.project.create_file(version='IFC4')
+    project = ifcopenshell.api.root.create_entity(ifc, ifc_class='IfcProject', name='Benchmark')
+    # Profiles are created directly in project units, so the model is in metres.
+    units = [
+        ifcopenshell.api.unit.add_si_unit(ifc, unit_type=unit_type)
+        for unit_type in ('LENGTHUNIT', 'AREAUNIT', 'VOLUMEUNIT')
+    ]
+    ifcopenshell.api.unit.assign_unit(ifc, units=units)
+    model = ifcopenshell.api.context.add_context(ifc, context_type='Model')
+    body = ifcopenshell.api.context.add_context(
+        ifc, context_type='Model', context_identifier='Body', target_view='MODEL_VIEW', parent=model
+    )
+    site = ifcopenshell.api.root.create_entity(ifc, ifc_class='IfcSite')
+    building = ifcopenshell.api.root.create_entity(ifc, ifc_class='IfcBuilding')
+    storey = ifcopenshell.api.root.create_entity(ifc, ifc_class='IfcBuildingStorey')
+    ifcopenshell.api.aggregate.assign_object(ifc, relating_object=project, products=[site])
+    ifcopenshell.api.aggregate.assign_object(ifc, relating_object=site, products=[building])
+    ifcopenshell.api.aggregate.assign_object(ifc, relating_object=building, products=[storey])
+    return ifc, body, storey
+
+
+def add_element(ifc, body, storey, ifc_class, representation, origin, z_axis=(0.0, 0.0, 1.0)):
+    element = ifcopenshell.api.root.create_entity(ifc, ifc_class=ifc_class)
+    ifcopenshell.api.geometry.assign_representation(ifc, product=element, representation=representation)
+    z_axis = np.array(z_axis)
+    x_axis = np.array((1.0, 0.0, 0.0)) if abs(z_axis[0]) < 0.5 else np.array((0.0, 0.0, 1.0))
+    matrix = np.eye(4)
+    matrix[:3, 0] = x_axis
+    matrix[:3, 1] = np.cross(z_axis, x_axis)
+    matrix[:3, 2] = z_axis
+    matrix[:3, 3] = origin
+    ifcopenshell.api.geometry.edit_object_placement(ifc, product=element, matrix=matrix)
+    ifcopenshell.api.spatial.assign_container(ifc, relating_structure=storey, products=[element])
+    return element
+
+
+def generate_models(count, spacing, overlap, seed, directory):
+    """Generate a walls model and a ducts and beams model laid out on a grid.
+
+    Walls are placed along X on a grid of ``spacing``. A share of ``overlap``
+    ducts and beams cross a random wall and the rest run between wall rows.
+    """
+    rng = random.Random(seed)
+    columns = math.ceil(math.sqrt(count))
+    wall_length = spacing * 0.8
+
+    walls, body, storey = create_model()
+    wall_origins = []
+    for i in range(count):
+        origin = (i % columns * spacing, i // columns * spacing, 0.0)
+        representation = ifcopenshell.api.geometry.add_wall_representation(
+            walls, context=body, length=wall_length, height=WALL_HEIGHT, thickness=WALL_THICKNESS
+        )
+        add_element(walls, body, storey, 'IfcWall', representation, origin)
+        wall_origins.append(origin)
+
+    services, body, storey = create_model()
+    duct_profile = services.createIfcCircleProfileDef(ProfileType='AREA', Radius=0.15)
+    beam_profile = services.createIfcRectangleProfileDef(ProfileType='AREA', XDim=0.2, YDim=0.4)
+    for i in range(count):
+        x, y, _ = rng.choice(wall_origins)
+        crosses = rng.random() < overlap
+        # Ducts run along Y through the middle of a wall, or along X between wall rows.
+        representation = ifcopenshell.api.geometry.add_profile_representation(
+            services, context=body, profile=duct_profile, depth=spacing * 0.5
+        )
+        if crosses:
+            origin, direction = (x + wall_length / 2, y - spacing * 0.25, 2.0), (0.0, 1.0, 0.0)
+        else:
+            origin, direction = (x + spacing * 0.25, y + spacing * 0.5, 2.0), (1.0, 0.0, 0.0)
+        add_element(services, body, storey, 'IfcDuctSegment', representation, origin, direction)
+
+        # Beams run along X on top of a wall, or between wall rows.
+        representation = ifcopenshell.api.geometry.add_profile_representation(
+            services, context=body, profile=beam_profile, depth=wall_length
+        )
+        y_offset = WALL_THICKNESS / 2 if crosses else spacing * 0.5
+        origin = (x, y + y_offset, WALL_HEIGHT + (-0.1 if crosses else 0.5))
+        add_element(services, body, storey, 'IfcBeam', representation, origin, (1.0, 0.0, 0.0))
+
+    paths = (Path(directory) / f'walls-{count}.ifc', Path(directory) / f'services-{count}.ifc')
+    walls.write(str(paths[0]))
+    services.write(str(paths[1]))
+    return paths
+
+
+def benchmark_mode(mode, paths, output):
+    settings = ClashSettings()
+    settings.output = output
+    settings.logger = logging.getLogger('Benchmark')
+    clasher = Clasher(settings)
+    clash_set = {
+        'name': mode,
+        'a': [{'file': str(paths[0])}],
+        'b': [{'file': str(paths[1])}],
+        'mode': mode,
+        **MODES[mode],
+    }
+    clasher.clash_sets = [clash_set]
+    clasher.clash()
+    clasher.export()
+
+    metrics = {**clash_set['metrics'], **clasher.export_metrics}
+    phases = {phase: metrics[phase]['wall_time'] for phase in PHASES if phase in metrics}
+    elements = len(clasher.groups['a']['elements']) + len(clasher.groups['b']['elements'])
+    return {
+        'mode': mode,
+        'elements': elements,
+        'triangles': metrics['tessellation']['triangles'],
+        'clashes': len(clash_set['clashes']),
+        'phases': phases,
+        'total': sum(phases.values()),
+        'seconds_per_thousand_elements': {k: v * 1000 / elements for k, v in phases.items()},
+    }
+
+
+@click.command()
+@click.option('--count', '-n', multiple=True, type=int, default=[100, 1000], help='Elements per class. Can be repeated (default: 100 and 1000)')
+@click.option('--spacing', default=4.0, type=float, help='Wall grid spacing in meters, controlling density (default: 4.0)')
+@click.option('--overlap', default=0.5, type=float, help='Share of ducts and beams that cross a wall (default: 0.5)')
+@click.option('--mode', 'modes', multiple=True, type=click.Choice(list(MODES)), default=list(MODES), help='Clash modes to benchmark (default: all)')
+@click.option('--seed', default=0, type=int, help='Random seed for the synthetic models (default: 0)')
+@click.option('--output', '-o', default='benchmark.json', help='Path to save the benchmark JSON (default: benchmark.json)')
+def benchmark(count, spacing, overlap, modes, seed, output):
+    """Time each phase of ifcclash on synthetic models."""
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in count:
+            start = time.perf_counter()
+            paths = generate_models(n, spacing, overlap, seed, directory)
+            click.echo(f'Generated {n} walls, ducts and beams in {time.perf_counter() - start:.2f}s')
+            for mode in modes:
+                record = benchmark_mode(mode, paths, str(Path(directory) / 'output.json'))
+                record.update({'count': n, 'spacing': spacing, 'overlap': overlap, 'seed': seed})
+                records.append(record)
+                click.echo(f"{mode} {n}: {record['clashes']} clashes in {record['total']:.2f}s")
+
+    with open(output, 'w') as f:
+        json.dump({'ifcopenshell': ifcopenshell.version, 'results': records}, f, indent=2)
+    click.echo(f'Benchmark saved as: {output}')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -22,26 +22,157 @@ import sys
 import json
 import logging
 import argparse
+from . import shard
 from .ifcclash import Clasher, ClashSettings
 
-parser = argparse.ArgumentParser(
-    description="Clashes geometry between two IFC files")
-parser.add_argument("input", type=str,
-                    help="A JSON dataset describing a series of clashsets")
-parser.add_argument(
-    "-o", "--output", type=str, help="The JSON diff file to output. Defaults to output.json", default="output.json"
-)
-args = parser.parse_args()
-
-settings = ClashSettings()
-settings.output = args.output
-settings.logger = logging.getLogger("Clash")
-settings.logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-settings.logger.addHandler(handler)
-ifc_clasher = Clasher(settings)
-with open(args.input, "r") as clash_sets_file:
-    ifc_clasher.clash_sets = json.loads(clash_sets_file.read())
-ifc_clasher.clash()
-ifc_clasher.export()
+
+def previous_ifc(value: str) -> tuple[str, str]:
+    current, separator, previous = value.partition("=")
+    if not separator or not current or not previous:
+        raise argparse.ArgumentTypeError("expected CURRENT=PREVIOUS")
+    return current, previous
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Clashes geometry between two IFC files")
+    parser.add_argument("input", type=str, nargs="?",
+                        help="A JSON dataset describing a series of clashsets")
+    parser.add_argument(
+        "-o", "--output", type=str, help="The JSON diff file to output. Defaults to output.json", default="output.json"
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Write JSON without indentation. Use a .ndjson output to stream clashes"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Number of clash sets to process in parallel worker processes. Defaults to 1", default=1
+    )
+    parser.add_argument(
+        "--previous", type=str, help="A previous JSON output to update incrementally instead of clashing everything"
+    )
+    parser.add_argument(
+        "--previous-ifc",
+        type=previous_ifc,
+        action="append",
+        default=[],
+        help="A changed IFC as CURRENT=PREVIOUS, where CURRENT matches the clash set file path. Can be repeated",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=float,
+        help="Clash one XY tile of this size at a time to bound memory on large models. Disabled by default",
+        default=None,
+    )
+    parser.add_argument(
+        "--group",
+        type=float,
+        metavar="DISTANCE",
+        help="Smart group clashes whose points are within this distance of each other",
+        default=None,
+    )
+    parser.add_argument(
+        "--bcf-topics",
+        type=str,
+        choices=["clash", "smart_group"],
+        help="Write a BCF topic per clash, or per smart group with --group. Defaults to clash",
+        default="clash",
+    )
+    parser.add_argument(
+        "--broad-phase",
+        action="store_true",
+        help="Filter elements by bounding box before exact clash tests and report candidate counts",
+    )
+    parser.add_argument("--metrics", type=str, help="A JSON file to save per clash set phase metrics to", default=None)
+    parser.add_argument(
+        "--profile", type=str, choices=["cprofile", "tracemalloc"], help="Capture a profile of the clash", default=None
+    )
+    parser.add_argument(
+        "--profile-output", type=str, help="The profile file to output. Defaults to the output path with a suffix"
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="Serve clash set requests over HTTP, keeping loaded models in memory"
+    )
+    parser.add_argument("--host", type=str, help="The host to serve on. Defaults to 127.0.0.1", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="The port to serve on. Defaults to 8000", default=8000)
+    parser.add_argument(
+        "--shards", type=int, metavar="N", help="Write N shard manifests of the input to --shard-dir and exit"
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        metavar="K/N",
+        help="Only clash shard K of N, by GlobalId range of group A, or by tile if --tile-size is set",
+    )
+    parser.add_argument("--shard-dir", type=str, help="A shared directory of shard manifests and outputs")
+    parser.add_argument(
+        "--merge-shards",
+        type=int,
+        metavar="N",
+        help="Combine the outputs of all N shards in --shard-dir into --output",
+    )
+    args = parser.parse_args()
+    if (args.shards or args.merge_shards) and not args.shard_dir:
+        parser.error("--shard-dir is required with --shards and --merge-shards")
+    if args.merge_shards is not None and args.merge_shards < 1:
+        parser.error("--merge-shards expects a shard count of at least 1")
+    if args.shard and args.previous:
+        parser.error("--shard can't be combined with --previous")
+    if args.serve and args.output.endswith(".ndjson"):
+        parser.error("--serve returns clashes in the response, so it can't stream them to a .ndjson output")
+    if args.group is not None and args.output.endswith(".ndjson"):
+        parser.error("--group can't be combined with a .ndjson output, as streamed clashes aren't kept to group")
+    if args.bcf_topics == "smart_group" and (args.group is None or not args.output.endswith(".bcf")):
+        parser.error("--bcf-topics smart_group requires --group and a .bcf output")
+    has_manifest = args.merge_shards or (args.shard and args.shard_dir)
+    if not args.input and not args.serve and not has_manifest:
+        parser.error("an input clash sets JSON is required unless --serve or --shard-dir is used")
+
+    settings = ClashSettings()
+    settings.output = args.output
+    settings.compact = args.compact
+    settings.jobs = args.jobs
+    settings.tile_size = args.tile_size
+    settings.broad_phase = args.broad_phase
+    settings.bcf_topics = args.bcf_topics
+    settings.metrics_output = args.metrics
+    settings.profile = args.profile
+    settings.profile_output = args.profile_output
+    settings.previous_output = args.previous
+    settings.previous_files = dict(args.previous_ifc)
+    settings.logger = logging.getLogger("Clash")
+    settings.logger.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.DEBUG)
+    settings.logger.addHandler(handler)
+    if args.shard:
+        try:
+            settings.shard = shard.parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.serve:
+        from .server import serve
+
+        serve(settings, args.host, args.port)
+        sys.exit()
+    if args.shards:
+        with open(args.input, "r") as clash_sets_file:
+            paths = shard.write_shard_manifests(json.load(clash_sets_file), args.shard_dir, args.shards, args.tile_size)
+        settings.logger.info(f"Wrote {len(paths)} shard manifests to {args.shard_dir}")
+        sys.exit()
+    if args.shard and args.shard_dir:
+        output = shard.run_shard(settings, args.shard_dir, *settings.shard)
+        settings.logger.info(f"Wrote shard {args.shard} to {output}")
+        sys.exit()
+    ifc_clasher = Clasher(settings)
+    if args.merge_shards:
+        try:
+            ifc_clasher.clash_sets = shard.merge_shards(args.shard_dir, args.merge_shards)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+    else:
+        with open(args.input, "r") as clash_sets_file:
+            ifc_clasher.clash_sets = json.loads(clash_sets_file.read())
+        ifc_clasher.clash()
+    if args.group is not None:
+        ifc_clasher.smart_group_clashes(ifc_clasher.clash_sets, args.group)
+    ifc_clasher.export()
@@ -0,0 +1,95 @@
+# IfcClash - IFC-based clash detection.
+# Copyright (C) 2020-2024 Dion Moult <dion@thinkmoult.com>
+#
+# This file is part of IfcClash.
+#
+# IfcClash is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# IfcClash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with IfcClash.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+import uuid
+import zipfile
+import datetime
+from typing import Iterable
+from xml.sax.saxutils import escape, quoteattr
+
+VERSION = """<?xml version="1.0" encoding="UTF-8"?>
+<Version VersionId="2.1"><DetailedVersion>2.1</DetailedVersion></Version>
+"""
+
+PROJECT = """<?xml version="1.0" encoding="UTF-8"?>
+<ProjectExtension><Project ProjectId={project_id}><Name>{name}</Name></Project><ExtensionSchema/></ProjectExtension>
+"""
+
+MARKUP = """<?xml version="1.0" encoding="UTF-8"?>
+<Markup><Topic Guid="{guid}"><Title>{title}</Title><CreationDate>{date}</CreationDate>\
+<CreationAuthor>{author}</CreationAuthor><Description>{description}</Description></Topic>\
+<Viewpoints Guid="{viewpoint_guid}"><Viewpoint>viewpoint.bcfv</Viewpoint></Viewpoints></Markup>
+"""
+
+VIEWPOINT = """<?xml version="1.0" encoding="UTF-8"?>
+<VisualizationInfo Guid="{guid}"><Components><Selection>{components}</Selection>\
+<Visibility DefaultVisibility="true"/></Components><PerspectiveCamera>\
+<CameraViewPoint><X>{x}</X><Y>{y}</Y><Z>{z}</Z></CameraViewPoint>\
+<CameraDirection><X>-0.5773502691896258</X><Y>-0.5773502691896258</Y><Z>-0.5773502691896258</Z></CameraDirection>\
+<CameraUpVector><X>-0.4082482904638631</X><Y>-0.4082482904638631</Y><Z>0.8164965809277261</Z></CameraUpVector>\
+<FieldOfView>60</FieldOfView></PerspectiveCamera></VisualizationInfo>
+"""
+
+# Cameras look at the clash point diagonally down from this distance along each axis.
+CAMERA_OFFSET = 5.0
+
+
+class BcfWriter:
+    """Write a BCF 2.1 archive one topic at a time, without building it in memory.
+
+    Each topic has a single viewpoint that selects its elements and looks at a
+    point. Topic GUIDs are derived from a key, so the same clash keeps the same
+    topic between exports.
+    """
+
+    def __init__(self, path: str, name: str, author: str = "IfcClash"):
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+        self.name = name
+        self.author = escape(author)
+        self.date = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+        self.archive.writestr("bcf.version", VERSION)
+        project_id = str(uuid.uuid5(uuid.NAMESPACE_OID, name))
+        self.archive.writestr("project.bcfp", PROJECT.format(project_id=quoteattr(project_id), name=escape(name)))
+
+    def __enter__(self) -> BcfWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add_topic(self, key: str, title: str, description: str, point: Iterable[float], guids: Iterable[str]) -> str:
+        guid = str(uuid.uuid5(uuid.NAMESPACE_OID, f"{self.name}/{key}"))
+        viewpoint_guid = str(uuid.uuid5(uuid.NAMESPACE_OID, f"{guid}/viewpoint"))
+        markup = MARKUP.format(
+            guid=guid,
+            title=escape(title),
+            date=self.date,
+            author=self.author,
+            description=escape(description),
+            viewpoint_guid=viewpoint_guid,
+        )
+        x, y, z = (float(v) + CAMERA_OFFSET for v in point)
+        components = "".join(f"<Component IfcGuid={quoteattr(g)}/>" for g in guids)
+        viewpoint = VIEWPOINT.format(guid=viewpoint_guid, components=components, x=x, y=y, z=z)
+        self.archive.writestr(f"{guid}/markup.bcf", markup)
+        self.archive.writestr(f"{guid}/viewpoint.bcfv", viewpoint)
+        return guid
+
+    def close(self) -> None:
+        self.archive.close()
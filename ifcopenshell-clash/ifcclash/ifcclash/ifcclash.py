@@ -20,15 +20,22 @@
 
 
 from __future__ import annotations
+import sys
 import json
 import time
+import hashlib
 import numpy as np
 import multiprocessing
 import ifcopenshell
 import ifcopenshell.geom
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
 import ifcopenshell.util.selector
+import ifcopenshell.util.shape
+import ifcopenshell.util.unit
 from logging import Logger
-from typing import Literal, TypedDict, Union
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Literal, TextIO, TypedDict, Union
 from typing_extensions import NotRequired
 
 
@@ -56,6 +63,21 @@ class ClashResult(TypedDict):
     distance: float
 
 
+class PhaseMetrics(TypedDict):
+    wall_time: float
+    cpu_time: float
+    # Peak resident set size of the process in bytes, at the end of the phase.
+    peak_rss: int
+    elements: NotRequired[int]
+    triangles: NotRequired[int]
+    # Candidate pairs in the broad phase, or clashes found in the narrow phase.
+    pairs: NotRequired[int]
+    # Candidate pairs dropped by exclusion rules.
+    excluded: NotRequired[int]
+    # Candidate pairs dropped because their mirrored pair is already clashed.
+    symmetric: NotRequired[int]
+
+
 class ClashSet(TypedDict):
     name: str
     a: list[ClashSource]
@@ -63,6 +85,7 @@ class ClashSet(TypedDict):
     mode: Literal["intersection", "collision", "clearance"]
     # Added during clash.
     clashes: NotRequired[dict[str, ClashResult]]
+    metrics: NotRequired[dict[str, PhaseMetrics]]
     # intersection, clearance modes.
     check_all: NotRequired[bool]
     # inseresection mode.
@@ -71,6 +94,17 @@ class ClashSet(TypedDict):
     allow_touching: NotRequired[bool]
     # clearance mode.
     clearance: NotRequired[float]
+    # Exclusion rules, applied to candidate pairs before exact clash tests.
+    # Pairs of IFC classes (including subclasses) never to clash, in either order.
+    ignore_class_pairs: NotRequired[list[tuple[str, str]]]
+    # Skip elements in the same aggregate, such as curtain wall panels.
+    exclude_same_aggregate: NotRequired[bool]
+    # Skip doors, windows and other fillings against the element hosting their opening.
+    exclude_host_openings: NotRequired[bool]
+    # Skip elements more than this many storeys apart, counting storeys by elevation across all files.
+    max_storey_separation: NotRequired[int]
+    # Storeys within this elevation in metres of each other are the same storey. Defaults to 0.5.
+    storey_tolerance: NotRequired[float]
 
 
 class ClashGroup(TypedDict):
@@ -86,139 +120,882 @@ class Clasher:
         self.logger = self.settings.logger
         self.groups: dict[str, ClashGroup] = {}
         self.ifcs: dict[str, ifcopenshell.file] = {}
+        # Trees are shared between clash sets and keyed by geometry settings.
+        self.trees: dict[str, ifcopenshell.geom.tree] = {}
+        # Elements already added to a tree, keyed by (geometry settings, file).
+        self.tree_elements: dict[tuple[str, str], set[int]] = {}
+        # Selected elements per source, keyed by (geometry settings, file, mode, selector).
+        self.sources: dict[tuple[str, str, str, str], dict[str, ifcopenshell.entity_instance]] = {}
         self.tree = None
+        # Bounding boxes as (minx, miny, minz, maxx, maxy, maxz) for candidate queries.
+        self.element_bounds: dict[ifcopenshell.entity_instance, np.ndarray] = {}
+        # Aggregate, opening hosts and storey per element, see get_exclusion_data().
+        self.exclusion_data: dict[ifcopenshell.entity_instance, tuple] = {}
+        # Storey levels of the clash set being filtered, see get_storey_levels().
+        self.storey_levels: dict[ifcopenshell.entity_instance, int] = {}
+        # NDJSON output that clashes are written to as they are found.
+        self.stream: Union[None, TextIO] = None
+        self.is_streamed = False
+        # Phase metrics of the clash set being processed.
+        self.metrics: dict[str, PhaseMetrics] = {}
+        self.export_metrics: dict[str, PhaseMetrics] = {}
 
     def clash(self) -> None:
+        if self.settings.output.endswith(".ndjson"):
+            self.stream = open(self.settings.output, "w", encoding="utf-8")
+        try:
+            with self.profile():
+                self.clash_all()
+        finally:
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+                self.is_streamed = True
+
+    def clash_all(self) -> None:
+        if self.settings.previous_output:
+            return self.clash_incremental()
+        if self.settings.jobs > 1 and len(self.clash_sets) > 1:
+            return self.clash_parallel()
         for clash_set in self.clash_sets:
-            print(clash_set)
+            self.logger.info(f"Processing clash set {clash_set['name']}")
             self.process_clash_set(clash_set)
 
+    def clash_parallel(self) -> None:
+        """Process clash sets in ``settings.jobs`` worker processes.
+
+        Each worker keeps its own :class:`Clasher`, so IFCs and trees are loaded
+        once per worker. Results are merged back in the original order.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        jobs = min(self.settings.jobs, len(self.clash_sets))
+        self.logger.info(f"Processing {len(self.clash_sets)} clash sets with {jobs} jobs")
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_clash_worker, initargs=(type(self), self.settings)
+        ) as executor:
+            results = executor.map(_process_clash_set, self.clash_sets)
+            for clash_set, (clashes, metrics) in zip(self.clash_sets, results):
+                clash_set["metrics"] = metrics
+                if self.stream:
+                    for clash_id, clash in clashes.items():
+                        self.write_clash(clash_set, clash_id, clash)
+                else:
+                    clash_set["clashes"] = clashes
+                self.logger.info(f"Finished clash set {clash_set['name']}")
+
+    def clash_incremental(self) -> None:
+        """Re-clash only elements that changed since ``settings.previous_output``.
+
+        Files in ``settings.previous_files`` are diffed against their previous
+        revision by GlobalId and geometry hash. Prior clashes between unchanged
+        elements are kept, and changed elements are re-tested against the other
+        group. Only changed elements, plus the group they are tested against,
+        are tessellated. Clash sets without prior results are fully processed.
+        """
+        with open(self.settings.previous_output, "r", encoding="utf-8") as previous_file:
+            previous_clash_sets: dict[str, ClashSet] = {c["name"]: c for c in json.load(previous_file)}
+
+        stale_global_ids: set[str] = set()
+        for path, previous_path in self.settings.previous_files.items():
+            with self.measure("diff") as counts:
+                changed = self.get_changed_global_ids(ifcopenshell.open(previous_path), self.load_ifc(path))
+                counts["elements"] = len(changed)
+            self.logger.info(f"Found {len(changed)} changed elements in {path}")
+            stale_global_ids |= changed
+        diff_metrics, self.metrics = self.metrics, {}
+
+        for clash_set in self.clash_sets:
+            self.logger.info(f"Processing clash set {clash_set['name']}")
+            previous_clash_set = previous_clash_sets.get(clash_set["name"], {})
+            if "clashes" not in previous_clash_set:
+                self.process_clash_set(clash_set)
+            else:
+                self.process_clash_set_incremental(clash_set, previous_clash_set["clashes"], stale_global_ids)
+            clash_set["metrics"].update(diff_metrics)
+
     def process_clash_set(self, clash_set: ClashSet) -> None:
-        self.tree = ifcopenshell.geom.tree()
+        self.metrics = {}
+        if self.settings.tile_size:
+            return self.process_clash_set_tiled(clash_set)
+        self.tree = self.get_tree()
+        b = self.create_clash_set_groups(clash_set)
+        a_elements = list(self.groups["a"]["elements"].values())
+        b_elements = list(self.groups[b]["elements"].values())
+        mirrored = None
+        if self.settings.shard:
+            # Pairs of elements in both groups are clashed by the shard of the element with the lower pair key.
+            mirrored = set(a_elements)
+            a_elements = self.get_shard_elements(a_elements)
+            index, count = self.settings.shard
+            self.logger.info(f"Clashing shard {index + 1}/{count} with {len(a_elements)} of {len(mirrored)} a")
+
+        for name, elements in {"a": set(a_elements), b: set(b_elements)}.items():
+            for source in clash_set[name]:
+                source_elements = self.get_source_elements(source).values()
+                self.add_tree_elements(source["file"], source["ifc"], [e for e in source_elements if e in elements])
+
+        results = self.clash_elements(clash_set, a_elements, b_elements, mirrored)
+        self.add_clash_results(clash_set, self.build_clash_results(results))
+
+    def process_clash_set_incremental(
+        self, clash_set: ClashSet, previous_clashes: dict[str, ClashResult], stale_global_ids: set[str]
+    ) -> None:
+        self.metrics = {}
+        self.tree = self.get_tree()
+        b = self.create_clash_set_groups(clash_set)
+        a_elements = self.groups["a"]["elements"]
+        b_elements = self.groups[b]["elements"]
+        a_changed = {g for g in a_elements if g in stale_global_ids}
+        b_changed = {g for g in b_elements if g in stale_global_ids} if b == "b" else set()
+        self.logger.info(f"Changed elements: {len(a_changed)} in a, {len(b_changed)} in b")
+
+        # Changed elements are tested against the whole opposite group, so only that group needs full geometry.
+        tessellate = {"a": set(a_changed), b: set(b_changed)}
+        if a_changed:
+            tessellate[b] = set(b_elements)
+        if b_changed:
+            tessellate["a"] = set(a_elements)
+        for name in {"a", b}:
+            for source in clash_set[name]:
+                source_elements = self.get_source_elements(source)
+                elements = [e for g, e in source_elements.items() if g in tessellate[name]]
+                self.add_tree_elements(source["file"], source["ifc"], elements)
+
+        clashes = {
+            clash_id: clash
+            for clash_id, clash in previous_clashes.items()
+            if clash["a_global_id"] not in stale_global_ids and clash["b_global_id"] not in stale_global_ids
+        }
+        self.logger.info(f"Kept previous clashes: {len(clashes)} of {len(previous_clashes)}")
+        if a_changed:
+            results = self.clash_elements(
+                clash_set, [a_elements[g] for g in a_changed], list(b_elements.values())
+            )
+            clashes.update(self.build_clash_results(results))
+        if b_changed:
+            results = self.clash_elements(
+                clash_set, list(a_elements.values()), [b_elements[g] for g in b_changed]
+            )
+            clashes.update(self.build_clash_results(results))
+        self.add_clash_results(clash_set, clashes.items())
+
+    def process_clash_set_tiled(self, clash_set: ClashSet) -> None:
+        """Clash one tile of ``settings.tile_size`` at a time to bound peak memory.
+
+        Element bounding boxes are computed in a first pass without keeping
+        geometry. Each tile, inflated by the tolerance or clearance, is then
+        tessellated into its own tree and clashed. Pairs found in several tiles
+        are only reported once. If ``settings.shard`` is set, only every Nth
+        tile is clashed.
+        """
+        b = self.create_clash_set_groups(clash_set)
+        margin = self.get_margin(clash_set)
+
+        bounds: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        with self.measure("bounds") as counts:
+            for name in {"a", b}:
+                for source in clash_set[name]:
+                    elements = set(self.get_source_elements(source).values())
+                    for shape in self.iterate_shapes(source["file"], source["ifc"], elements):
+                        verts = ifcopenshell.util.shape.get_shape_vertices(shape, shape.geometry)
+                        if len(verts):
+                            bounds[shape.guid] = (verts.min(axis=0), verts.max(axis=0))
+            counts["elements"] = len(bounds)
+        if not bounds:
+            return self.add_clash_results(clash_set, [])
+
+        def get_group_bounds(name: str) -> tuple[list[str], np.ndarray, np.ndarray]:
+            global_ids = [g for g in self.groups[name]["elements"] if g in bounds]
+            mins = np.array([bounds[g][0] for g in global_ids]).reshape((-1, 3))
+            maxs = np.array([bounds[g][1] for g in global_ids]).reshape((-1, 3))
+            return global_ids, mins, maxs
+
+        a_bounds = get_group_bounds("a")
+        b_bounds = a_bounds if b == "a" else get_group_bounds(b)
+        project_min = np.min([v[0] for v in bounds.values()], axis=0)
+        project_max = np.max([v[1] for v in bounds.values()], axis=0)
+        tile_size = self.settings.tile_size
+        tiles = np.maximum(np.ceil((project_max[:2] - project_min[:2]) / tile_size), 1).astype(int)
+        self.logger.info(f"Clashing {tiles[0]} x {tiles[1]} tiles of {tile_size}")
+
+        def get_tile_elements(name: str, group_bounds, tile_min: np.ndarray, tile_max: np.ndarray) -> dict:
+            global_ids, mins, maxs = group_bounds
+            overlaps = np.all((maxs[:, :2] >= tile_min) & (mins[:, :2] <= tile_max), axis=1)
+            elements = self.groups[name]["elements"]
+            return {global_ids[i]: elements[global_ids[i]] for i in np.flatnonzero(overlaps)}
+
+        def clash_tiles() -> Iterator[tuple[str, ClashResult]]:
+            seen: set[str] = set()
+            for x in range(tiles[0]):
+                for y in range(tiles[1]):
+                    if self.settings.shard and (x * tiles[1] + y) % self.settings.shard[1] != self.settings.shard[0]:
+                        continue
+                    tile_min = project_min[:2] + np.array((x, y)) * tile_size - margin
+                    tile_max = project_min[:2] + np.array((x + 1, y + 1)) * tile_size + margin
+                    a_elements = get_tile_elements("a", a_bounds, tile_min, tile_max)
+                    b_elements = a_elements if b == "a" else get_tile_elements(b, b_bounds, tile_min, tile_max)
+                    if not a_elements or not b_elements:
+                        continue
+                    self.logger.info(f"Clashing tile {x},{y} ({len(a_elements)} a, {len(b_elements)} b)")
+                    self.tree = ifcopenshell.geom.tree()
+                    for name, tile_elements in {"a": a_elements, b: b_elements}.items():
+                        for source in clash_set[name]:
+                            source_elements = self.get_source_elements(source)
+                            elements = {e for g, e in source_elements.items() if g in tile_elements}
+                            self.add_shapes(source["file"], source["ifc"], elements)
+                    results = self.clash_elements(
+                        clash_set, list(a_elements.values()), list(b_elements.values())
+                    )
+                    for clash_id, clash in self.build_clash_results(results):
+                        if clash_id not in seen:
+                            seen.add(clash_id)
+                            yield clash_id, clash
+                    self.tree = None
+
+        self.add_clash_results(clash_set, clash_tiles())
+
+    def create_clash_set_groups(self, clash_set: ClashSet) -> Literal["a", "b"]:
+        """Load the sources of a clash set into groups and return the name of the group to clash against."""
         self.create_group("a")
         for source in clash_set["a"]:
             source["ifc"] = self.load_ifc(source["file"])
-            self.add_collision_objects("a", source["ifc"], source)
+            self.groups["a"]["elements"].update(self.get_source_elements(source))
 
         if "b" in clash_set and clash_set["b"]:
             self.create_group("b")
             for source in clash_set["b"]:
                 source["ifc"] = self.load_ifc(source["file"])
-                self.add_collision_objects("b", source["ifc"], source)
-            b = "b"
-        else:
-            b = "a"
+                self.groups["b"]["elements"].update(self.get_source_elements(source))
+            return "b"
+        return "a"
+
+    def clash_elements(
+        self,
+        clash_set: ClashSet,
+        a: list[ifcopenshell.entity_instance],
+        b: list[ifcopenshell.entity_instance],
+        mirrored: Union[None, set[ifcopenshell.entity_instance]] = None,
+    ) -> list:
+        if self.settings.broad_phase:
+            a, b = self.filter_broad_phase(a, b, self.get_margin(clash_set))
+        if self.has_exclusions(clash_set) or mirrored is not None:
+            return self.clash_filtered_elements(clash_set, a, b, mirrored)
+        with self.measure("clash") as counts:
+            counts["elements"] = len(a) + len(b)
+            results = self.clash_element_sets(clash_set, a, b)
+            counts["pairs"] = len(results)
+        return results
 
+    def clash_element_sets(
+        self, clash_set: ClashSet, a: list[ifcopenshell.entity_instance], b: list[ifcopenshell.entity_instance]
+    ) -> list:
         mode = clash_set["mode"]
         if mode == "intersection":
-            results = self.tree.clash_intersection_many(
-                list(self.groups["a"]["elements"].values()),
-                list(self.groups[b]["elements"].values()),
+            return self.tree.clash_intersection_many(
+                a,
+                b,
                 tolerance=clash_set["tolerance"],
                 check_all=clash_set["check_all"],
             )
         elif mode == "collision":
-            results = self.tree.clash_collision_many(
-                list(self.groups["a"]["elements"].values()),
-                list(self.groups[b]["elements"].values()),
+            return self.tree.clash_collision_many(
+                a,
+                b,
                 allow_touching=clash_set["allow_touching"],
             )
         elif mode == "clearance":
-            results = self.tree.clash_clearance_many(
-                list(self.groups["a"]["elements"].values()),
-                list(self.groups[b]["elements"].values()),
+            return self.tree.clash_clearance_many(
+                a,
+                b,
                 clearance=clash_set["clearance"],
                 check_all=clash_set["check_all"],
             )
-        else:
-            assert False, f"Unexpected mode '{mode}'."
+        assert False, f"Unexpected mode '{mode}'."
+
+    def clash_filtered_elements(
+        self,
+        clash_set: ClashSet,
+        a: list[ifcopenshell.entity_instance],
+        b: list[ifcopenshell.entity_instance],
+        mirrored: Union[None, set[ifcopenshell.entity_instance]] = None,
+    ) -> list:
+        """Clash each element of ``a`` only against its candidates in ``b`` that no exclusion rule skips.
 
+        As each element is clashed on its own, pairs of elements in both ``a``
+        and ``b``, such as when a group is clashed against itself, would be
+        found from both sides. They are only clashed from the element that
+        comes first in :meth:`get_pair_key` order.
+
+        :param mirrored: Elements whose pairs with ``b`` are clashed from their
+            own side, in this call or another. Defaults to ``a``.
+        """
+        margin = self.get_margin(clash_set)
+        has_exclusions = self.has_exclusions(clash_set)
+        with self.measure("filter") as counts:
+            mirrored = set(a) if mirrored is None else mirrored
+            b_elements = set(b)
+            b_index = self.get_box_index(b)
+            class_matches: dict[ifcopenshell.entity_instance, set[tuple[int, int]]] = {}
+            if clash_set.get("max_storey_separation") is not None:
+                self.storey_levels = self.get_storey_levels(clash_set)
+            element_candidates = []
+            pairs = excluded = symmetric = 0
+            for element in a:
+                candidates = self.get_candidates(element, b_index, margin)
+                if element in b_elements:
+                    key = self.get_pair_key(element)
+                    total = len(candidates)
+                    candidates = [e for e in candidates if e not in mirrored or key < self.get_pair_key(e)]
+                    symmetric += total - len(candidates)
+                kept = candidates
+                if has_exclusions:
+                    kept = [e for e in candidates if not self.is_excluded(clash_set, element, e, class_matches)]
+                excluded += len(candidates) - len(kept)
+                pairs += len(kept)
+                if kept:
+                    element_candidates.append((element, kept))
+            counts["pairs"] = pairs
+            counts["excluded"] = excluded
+            counts["symmetric"] = symmetric
+        if has_exclusions:
+            self.logger.info(f"Exclusion rules skipped {excluded} of {pairs + excluded} candidate pairs")
+        if symmetric:
+            self.logger.info(f"Skipped {symmetric} mirrored candidate pairs")
+
+        results = []
+        with self.measure("clash") as counts:
+            for element, candidates in element_candidates:
+                results.extend(self.clash_element_sets(clash_set, [element], candidates))
+            counts["elements"] = len(element_candidates)
+            counts["pairs"] = len(results)
+        return results
+
+    def filter_broad_phase(
+        self, a: list[ifcopenshell.entity_instance], b: list[ifcopenshell.entity_instance], margin: float
+    ) -> tuple[list[ifcopenshell.entity_instance], list[ifcopenshell.entity_instance]]:
+        """Drop elements whose bounding box, inflated by ``margin``, overlaps no box in the other group.
+
+        Boxes are computed when shapes are added to the tree. Candidate pairs
+        are counted in the ``broad_phase`` metrics, and narrow phase results
+        in the ``clash`` metrics.
+        """
+        with self.measure("broad_phase") as counts:
+            b_index = self.get_box_index(b)
+            a_candidates = []
+            b_candidates = set()
+            pairs = 0
+            for element in a:
+                candidates = self.get_candidates(element, b_index, margin)
+                if candidates:
+                    a_candidates.append(element)
+                    b_candidates.update(candidates)
+                    pairs += len(candidates)
+            counts["elements"] = len(a_candidates) + len(b_candidates)
+            counts["pairs"] = pairs
+        self.logger.info(
+            f"Broad phase kept {len(a_candidates)} of {len(a)} a and {len(b_candidates)} of {len(b)} b with {pairs} pairs"
+        )
+        return a_candidates, [e for e in b if e in b_candidates]
+
+    def get_box_index(
+        self, elements: Iterable[ifcopenshell.entity_instance]
+    ) -> tuple[list[ifcopenshell.entity_instance], np.ndarray, float]:
+        """Sort the bounding boxes of elements by minimum X for :meth:`get_candidates`.
+
+        :return: The elements, their boxes in the same order and the largest box width in X.
+        """
+        elements = [e for e in elements if e in self.element_bounds]
+        boxes = np.array([self.element_bounds[e] for e in elements], dtype=float).reshape((-1, 6))
+        order = np.argsort(boxes[:, 0], kind="stable")
+        boxes = boxes[order]
+        max_width = float((boxes[:, 3] - boxes[:, 0]).max()) if len(boxes) else 0.0
+        return [elements[i] for i in order], boxes, max_width
+
+    def get_candidates(
+        self,
+        element: ifcopenshell.entity_instance,
+        index: tuple[list[ifcopenshell.entity_instance], np.ndarray, float],
+        margin: float,
+    ) -> list[ifcopenshell.entity_instance]:
+        """Return other elements of a box index whose bounding box overlaps the element's, inflated by ``margin``."""
+        bounds = self.element_bounds.get(element, None)
+        if bounds is None:
+            return []
+        elements, boxes, max_width = index
+        # Only boxes starting within the widest box of this one can overlap it in X.
+        start = np.searchsorted(boxes[:, 0], bounds[0] - margin - max_width, side="left")
+        end = np.searchsorted(boxes[:, 0], bounds[3] + margin, side="right")
+        window = boxes[start:end]
+        overlaps = np.all((window[:, 3:] >= bounds[:3] - margin) & (window[:, :3] <= bounds[3:] + margin), axis=1)
+        return [elements[i] for i in (np.flatnonzero(overlaps) + start).tolist() if elements[i] != element]
+
+    def get_shard_elements(self, elements: list[ifcopenshell.entity_instance]) -> list[ifcopenshell.entity_instance]:
+        """Return the contiguous range of ``elements``, ordered by pair key, in ``settings.shard``."""
+        index, count = self.settings.shard
+        elements = sorted(elements, key=self.get_pair_key)
+        return elements[len(elements) * index // count : len(elements) * (index + 1) // count]
+
+    def get_pair_key(self, element: ifcopenshell.entity_instance) -> tuple[str, int]:
+        """Return the key that orders the two elements of a pair, so that each pair has one canonical clash ID."""
+        return (element.GlobalId, element.id())
+
+    def has_exclusions(self, clash_set: ClashSet) -> bool:
+        return bool(
+            clash_set.get("ignore_class_pairs")
+            or clash_set.get("exclude_same_aggregate")
+            or clash_set.get("exclude_host_openings")
+            or clash_set.get("max_storey_separation") is not None
+        )
+
+    def is_excluded(
+        self,
+        clash_set: ClashSet,
+        element1: ifcopenshell.entity_instance,
+        element2: ifcopenshell.entity_instance,
+        class_matches: dict[ifcopenshell.entity_instance, set[tuple[int, int]]],
+    ) -> bool:
+        """Check whether a candidate pair is skipped by the exclusion rules of a clash set.
+
+        :param class_matches: A cache of the ``(pair index, class index)`` of
+            ``ignore_class_pairs`` matched by each element.
+        """
+        if ignore_class_pairs := clash_set.get("ignore_class_pairs"):
+            classes1 = self.get_class_matches(ignore_class_pairs, element1, class_matches)
+            classes2 = self.get_class_matches(ignore_class_pairs, element2, class_matches)
+            for i in range(len(ignore_class_pairs)):
+                if ((i, 0) in classes1 and (i, 1) in classes2) or ((i, 1) in classes1 and (i, 0) in classes2):
+                    return True
+        aggregate1, hosts1, storey1 = self.get_exclusion_data(element1)
+        aggregate2, hosts2, storey2 = self.get_exclusion_data(element2)
+        if clash_set.get("exclude_same_aggregate") and aggregate1 is not None and aggregate1 == aggregate2:
+            return True
+        if clash_set.get("exclude_host_openings") and (element2 in hosts1 or element1 in hosts2):
+            return True
+        max_storey_separation = clash_set.get("max_storey_separation")
+        if max_storey_separation is not None and storey1 is not None and storey2 is not None:
+            return abs(self.storey_levels[storey1] - self.storey_levels[storey2]) > max_storey_separation
+        return False
+
+    def get_class_matches(
+        self,
+        ignore_class_pairs: list[tuple[str, str]],
+        element: ifcopenshell.entity_instance,
+        class_matches: dict[ifcopenshell.entity_instance, set[tuple[int, int]]],
+    ) -> set[tuple[int, int]]:
+        matches = class_matches.get(element, None)
+        if matches is None:
+            matches = class_matches[element] = {
+                (i, j)
+                for i, class_pair in enumerate(ignore_class_pairs)
+                for j, ifc_class in enumerate(class_pair)
+                if element.is_a(ifc_class)
+            }
+        return matches
+
+    def get_exclusion_data(self, element: ifcopenshell.entity_instance) -> tuple:
+        """Return the aggregate, opening hosts and storey of an element."""
+        data = self.exclusion_data.get(element, None)
+        if data is None:
+            aggregate = ifcopenshell.util.element.get_aggregate(element)
+            hosts = set()
+            for rel in getattr(element, "FillsVoids", []):
+                for voids in rel.RelatingOpeningElement.VoidsElements:
+                    hosts.add(voids.RelatingBuildingElement)
+            storey = ifcopenshell.util.element.get_container(element, ifc_class="IfcBuildingStorey")
+            data = self.exclusion_data[element] = (aggregate, hosts, storey)
+        return data
+
+    def get_storey_levels(self, clash_set: ClashSet) -> dict[ifcopenshell.entity_instance, int]:
+        """Number the storeys of every file in a clash set by elevation.
+
+        Storeys are numbered across files rather than within each file, so
+        that a model with an extra storey, such as a foundation, still lines
+        up with the others. Elevations are compared in metres, and storeys
+        within ``storey_tolerance`` of each other share a level.
+        """
+        tolerance = clash_set.get("storey_tolerance", 0.5)
+        elevations = []
+        for source in clash_set["a"] + (clash_set.get("b") or []):
+            ifc_file = source["ifc"]
+            unit_scale = ifcopenshell.util.unit.calculate_unit_scale(ifc_file)
+            for storey in ifc_file.by_type("IfcBuildingStorey"):
+                elevations.append((ifcopenshell.util.placement.get_storey_elevation(storey) * unit_scale, storey))
+        elevations.sort(key=lambda e: e[0])
+        levels = {}
+        level, level_elevation = -1, None
+        for elevation, storey in elevations:
+            if level_elevation is None or elevation - level_elevation > tolerance:
+                level, level_elevation = level + 1, elevation
+            levels[storey] = level
+        return levels
+
+    def get_margin(self, clash_set: ClashSet) -> float:
+        """Return the distance by which bounding boxes are inflated when looking for clash candidates."""
+        if clash_set["mode"] == "clearance":
+            return clash_set.get("clearance", 0.0)
+        return clash_set.get("tolerance", 0.0)
+
+    def add_clash_results(self, clash_set: ClashSet, results: Iterable[tuple[str, ClashResult]]) -> None:
         processed_results: dict[str, ClashResult] = {}
-        for result in results:
-            element1 = result.a
-            element2 = result.b
-            print(f"result: {result}")
-            # print(f"element1: {element1}")
-            # print(f"element2: {element2}")
-
-            processed_results[f"{element1.get_argument(0)}-{element2.get_argument(0)}"] = ClashResult(
-                a_global_id=element1.get_argument(0),
-                b_global_id=element2.get_argument(0),
-                a_ifc_class=element1.is_a(),
-                b_ifc_class=element2.is_a(),
-                a_name=element1.get_argument(2),
-                b_name=element2.get_argument(2),
-                type=["protrusion", "pierce", "collision",
-                      "clearance"][result.clash_type],
-                p1=list(result.p1),
-                p2=list(result.p2),
-                distance=result.distance,
-            )
+        total_results = 0
+        for clash_id, clash in results:
+            total_results += 1
+            if self.stream:
+                self.write_clash(clash_set, clash_id, clash)
+            else:
+                processed_results[clash_id] = clash
+        clash_set["metrics"] = self.metrics
+        if self.stream:
+            self.logger.info(f"Found clashes: {total_results}")
+            return
         clash_set["clashes"] = processed_results
         self.logger.info(f"Found clashes: {len(processed_results.keys())}")
 
+    def build_clash_results(self, results: list, batch_size: int = 10000) -> Iterator[tuple[str, ClashResult]]:
+        """Convert raw tree clash results into ``(clash_id, ClashResult)`` pairs.
+
+        Element attributes are looked up once per element and points are
+        converted a batch at a time, with progress logged per batch.
+        """
+        clash_types: list[ClashType] = ["protrusion", "pierce", "collision", "clearance"]
+        # Results hold unhashable wrapper instances, so they are keyed by file and ID.
+        element_data: dict[tuple[int, int], tuple[str, str, str]] = {}
+
+        def get_element_data(element: ifcopenshell.ifcopenshell_wrapper.entity_instance) -> tuple[str, str, str]:
+            key = (element.file_pointer(), element.id())
+            data = element_data.get(key, None)
+            if data is None:
+                data = element_data[key] = (element.get_argument(0), element.is_a(), element.get_argument(2))
+            return data
+
+        results = list(results)
+        total = len(results)
+        for start in range(0, total, batch_size):
+            with self.measure("results", log=False) as counts:
+                batch = results[start : start + batch_size]
+                p1s = np.array([result.p1 for result in batch], dtype=float).tolist()
+                p2s = np.array([result.p2 for result in batch], dtype=float).tolist()
+                clashes: list[tuple[str, ClashResult]] = []
+                for result, p1, p2 in zip(batch, p1s, p2s):
+                    a_global_id, a_ifc_class, a_name = get_element_data(result.a)
+                    b_global_id, b_ifc_class, b_name = get_element_data(result.b)
+                    clash = ClashResult(
+                        a_global_id=a_global_id,
+                        b_global_id=b_global_id,
+                        a_ifc_class=a_ifc_class,
+                        b_ifc_class=b_ifc_class,
+                        a_name=a_name,
+                        b_name=b_name,
+                        type=clash_types[result.clash_type],
+                        p1=p1,
+                        p2=p2,
+                        distance=result.distance,
+                    )
+                    # Sorted GlobalIds give a pair the same ID whichever way round the tree reports it.
+                    if a_global_id <= b_global_id:
+                        clashes.append((f"{a_global_id}-{b_global_id}", clash))
+                    else:
+                        clashes.append((f"{b_global_id}-{a_global_id}", clash))
+                counts["elements"] = len(clashes)
+            yield from clashes
+            self.logger.info(f"Processed results {min(start + batch_size, total)}/{total}")
+
+    def write_clash(self, clash_set: ClashSet, clash_id: str, clash: ClashResult) -> None:
+        """Write a single clash as one NDJSON line to the output stream."""
+        assert self.stream
+        self.stream.write(json.dumps({"clash_set": clash_set["name"], "id": clash_id, **clash}, separators=(",", ":")))
+        self.stream.write("\n")
+
     def create_group(self, name: str) -> None:
         self.logger.info(f"Creating group {name}")
         self.groups[name] = {"elements": {}, "objects": {}}
 
     def load_ifc(self, path: str) -> ifcopenshell.file:
-        start = time.time()
-        self.settings.logger.info(f"Loading IFC {path}")
         ifc = self.ifcs.get(path, None)
         if not ifc:
-            ifc = ifcopenshell.open(path)
+            self.settings.logger.info(f"Loading IFC {path}")
+            with self.measure("load"):
+                ifc = ifcopenshell.open(path)
             assert isinstance(ifc, ifcopenshell.file)
             self.ifcs[path] = ifc
-        self.settings.logger.info(f"Loading finished {time.time() - start}")
         return ifc
 
+    def get_tree(self) -> ifcopenshell.geom.tree:
+        """Return the tree for the current geometry settings, reused across clash sets."""
+        settings_key = self.get_geom_settings_key()
+        tree = self.trees.get(settings_key, None)
+        if tree is None:
+            tree = self.trees[settings_key] = ifcopenshell.geom.tree()
+        return tree
+
+    def get_source_key(self, source: ClashSource) -> tuple[str, str, str, str]:
+        mode = source.get("mode")
+        selector = source.get("selector")
+        if not mode or mode == "a" or not selector:
+            mode, selector = "a", ""
+        return (self.get_geom_settings_key(), source["file"], mode, selector)
+
+    def get_source_elements(self, source: ClashSource) -> dict[str, ifcopenshell.entity_instance]:
+        """Return the elements selected by a source, keyed by GlobalId."""
+        source_key = self.get_source_key(source)
+        source_elements = self.sources.get(source_key, None)
+        if source_elements is not None:
+            return source_elements
+
+        _, _, mode, selector = source_key
+        ifc_file = source["ifc"]
+        with self.measure("selection") as counts:
+            if mode == "a":
+                elements = set(ifc_file.by_type("IfcElement"))
+                elements -= set(ifc_file.by_type("IfcFeatureElement"))
+            elif mode == "e":
+                elements = set(ifc_file.by_type("IfcElement"))
+                elements -= set(ifc_file.by_type("IfcFeatureElement"))
+                elements -= set(ifcopenshell.util.selector.filter_elements(ifc_file, selector))
+            elif mode == "i":
+                elements = set(
+                    ifcopenshell.util.selector.filter_elements(ifc_file, selector))
+            source_elements = self.sources[source_key] = {e.GlobalId: e for e in elements}
+            counts["elements"] = len(source_elements)
+        return source_elements
+
     def add_collision_objects(
         self,
         name: str,
         ifc_file: ifcopenshell.file,
         source: ClashSource,
     ) -> None:
-        mode = source.get("mode")
-        selector = source.get("selector")
-        start = time.time()
-        self.settings.logger.info("Creating iterator")
-        if not mode or mode == "a" or not selector:
-            elements = set(ifc_file.by_type("IfcElement"))
-            elements -= set(ifc_file.by_type("IfcFeatureElement"))
-        elif mode == "e":
-            elements = set(ifc_file.by_type("IfcElement"))
-            elements -= set(ifc_file.by_type("IfcFeatureElement"))
-            elements -= set(ifcopenshell.util.selector.filter_elements(ifc_file, selector))
-        elif mode == "i":
-            elements = set(
-                ifcopenshell.util.selector.filter_elements(ifc_file, selector))
+        source_elements = self.get_source_elements(source)
+        self.add_tree_elements(source["file"], ifc_file, source_elements.values())
+        self.groups[name]["elements"].update(source_elements)
+
+    def add_tree_elements(
+        self, path: str, ifc_file: ifcopenshell.file, elements: Iterable[ifcopenshell.entity_instance]
+    ) -> None:
+        """Tessellate and add elements to the tree, skipping those already added."""
+        # Elements may already be in the tree from an overlapping source of the same file.
+        tree_elements = self.tree_elements.setdefault((self.get_geom_settings_key(), path), set())
+        new_elements = {e for e in elements if e.id() not in tree_elements}
+        if not new_elements:
+            return
+
+        self.logger.info(f"Adding objects from {path} ({len(new_elements)} elements)")
+        self.add_shapes(path, ifc_file, new_elements)
+        tree_elements.update(e.id() for e in new_elements)
+
+    def add_shapes(self, path: str, ifc_file: ifcopenshell.file, elements: set[ifcopenshell.entity_instance]) -> None:
+        """Tessellate elements into the current tree, measuring tessellation and tree insertion separately."""
+        tree_wall_time = tree_cpu_time = 0.0
+        with self.measure("tessellation") as counts:
+            counts["elements"] = counts["triangles"] = 0
+            for shape in self.iterate_shapes(path, ifc_file, elements):
+                verts = ifcopenshell.util.shape.get_shape_vertices(shape, shape.geometry)
+                if len(verts):
+                    self.element_bounds[ifc_file.by_id(shape.id)] = np.concatenate((verts.min(axis=0), verts.max(axis=0)))
+                wall_time, cpu_time = time.perf_counter(), time.process_time()
+                self.tree.add_element(shape)
+                tree_wall_time += time.perf_counter() - wall_time
+                tree_cpu_time += time.process_time() - cpu_time
+                counts["elements"] += 1
+                counts["triangles"] += len(shape.geometry.faces_buffer) // 12
+            # Tree insertion is interleaved with the iterator, so it is reported as its own phase.
+            counts["wall_time"] = -tree_wall_time
+            counts["cpu_time"] = -tree_cpu_time
+        self.record_phase("tree", tree_wall_time, tree_cpu_time, elements=counts["elements"])
+
+    def iterate_shapes(
+        self, path: str, ifc_file: ifcopenshell.file, elements: set[ifcopenshell.entity_instance]
+    ) -> Iterator[ifcopenshell.geom.ShapeElementType]:
+        """Tessellate elements."""
         iterator = ifcopenshell.geom.iterator(
-            self.geom_settings, ifc_file, multiprocessing.cpu_count(), include=elements
+            self.geom_settings, ifc_file, self.settings.threads or multiprocessing.cpu_count(), include=elements
         )
-        self.settings.logger.info(
-            f"Iterator creation finished {time.time() - start}")
-
-        start = time.time()
-        self.logger.info(f"Adding objects {name} ({len(elements)} elements)")
-        assert iterator.initialize()
+        if not iterator.initialize():
+            return
         while True:
-            self.tree.add_element(iterator.get())
-            shape = iterator.get()
+            yield iterator.get()
             if not iterator.next():
                 break
-        self.logger.info(f"Tree finished {time.time() - start}")
-        start = time.time()
-        self.groups[name]["elements"].update({e.GlobalId: e for e in elements})
-        self.logger.info(f"Element metadata finished {time.time() - start}")
-        start = time.time()
+
+    @contextmanager
+    def measure(self, phase: str, log: bool = True) -> Iterator[dict]:
+        """Measure wall time, CPU time and peak RSS of a phase of the current clash set.
+
+        Counts such as ``elements`` and ``triangles`` may be set on the yielded dict.
+        """
+        counts = {}
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield counts
+        finally:
+            wall_time = time.perf_counter() - wall_time + counts.pop("wall_time", 0.0)
+            cpu_time = time.process_time() - cpu_time + counts.pop("cpu_time", 0.0)
+            self.record_phase(phase, wall_time, cpu_time, **counts)
+            if log:
+                self.logger.info(f"{phase.capitalize()} finished {wall_time:.3f}s")
+
+    def record_phase(self, phase: str, wall_time: float, cpu_time: float, **counts: int) -> None:
+        metrics = self.metrics.setdefault(phase, PhaseMetrics(wall_time=0.0, cpu_time=0.0, peak_rss=0))
+        metrics["wall_time"] += wall_time
+        metrics["cpu_time"] += cpu_time
+        metrics["peak_rss"] = self.get_peak_rss()
+        for key, value in counts.items():
+            metrics[key] = metrics.get(key, 0) + value
+
+    def get_peak_rss(self) -> int:
+        try:
+            import resource
+        except ImportError:  # Windows
+            return 0
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes.
+        return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """Capture a cProfile or tracemalloc profile if ``settings.profile`` is set."""
+        profile = self.settings.profile
+        output = self.settings.profile_output or f"{self.settings.output}.{'prof' if profile == 'cprofile' else 'txt'}"
+        if profile == "cprofile":
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(output)
+                self.logger.info(f"Saved cProfile stats to {output}")
+        elif profile == "tracemalloc":
+            import tracemalloc
+
+            tracemalloc.start()
+            try:
+                yield
+            finally:
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                with open(output, "w", encoding="utf-8") as profile_file:
+                    profile_file.write(f"Current: {current} bytes, peak: {peak} bytes\n")
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        profile_file.write(f"{stat}\n")
+                self.logger.info(f"Saved tracemalloc statistics to {output}")
+        else:
+            yield
+
+    def get_changed_global_ids(self, previous_ifc: ifcopenshell.file, ifc_file: ifcopenshell.file) -> set[str]:
+        """Return GlobalIds of elements that were added, removed or changed between two revisions."""
+        hashes = {}
+        previous_hashes = {e.GlobalId: self.get_element_hash(e, hashes) for e in previous_ifc.by_type("IfcElement")}
+        changed = set()
+        hashes = {}
+        for element in ifc_file.by_type("IfcElement"):
+            if previous_hashes.pop(element.GlobalId, None) != self.get_element_hash(element, hashes):
+                changed.add(element.GlobalId)
+        return changed | set(previous_hashes)
+
+    def get_element_hash(self, element: ifcopenshell.entity_instance, hashes: dict[int, str]) -> str:
+        """Hash the class, name, placement and representation of an element, including its openings.
+
+        The hash only depends on attribute values, so it is stable when entity
+        IDs are renumbered between revisions. ``hashes`` memoises entity hashes
+        within one file.
+        """
+
+        def hash_value(value) -> str:
+            if isinstance(value, ifcopenshell.entity_instance):
+                if value.id() in hashes:
+                    return hashes[value.id()]
+                result = hashlib.md5(f"{value.is_a()}({','.join(hash_value(v) for v in value)})".encode("utf-8"))
+                if value.id():
+                    hashes[value.id()] = result.hexdigest()
+                return result.hexdigest()
+            elif isinstance(value, (tuple, list)):
+                return f"({','.join(hash_value(v) for v in value)})"
+            return repr(value)
+
+        key = [element.is_a(), repr(element.Name), hash_value(element.ObjectPlacement), hash_value(element.Representation)]
+        for rel in getattr(element, "HasOpenings", []):
+            opening = rel.RelatedOpeningElement
+            key.extend((hash_value(opening.ObjectPlacement), hash_value(opening.Representation)))
+        return hashlib.md5(";".join(key).encode("utf-8")).hexdigest()
+
+    def get_geom_settings_key(self) -> str:
+        values = []
+        for name in sorted(self.geom_settings.setting_names()):
+            try:
+                values.append(f"{name}={self.geom_settings.get(name)}")
+            except RuntimeError:
+                pass  # Settings without a default raise until they are set.
+        return ";".join(values)
 
     def export(self) -> None:
-        """Save clash results to ``settings.output``."""
-        if len(self.settings.output) > 4 and self.settings.output[-4:] == ".bcf":
-            return self.export_bcfxml()
-        self.export_json()
+        """Save clash results to ``settings.output``, and metrics to ``settings.metrics_output`` if set."""
+        self.metrics = {}
+        with self.measure("export"):
+            if len(self.settings.output) > 4 and self.settings.output[-4:] == ".bcf":
+                self.export_bcfxml()
+            elif self.settings.output.endswith(".ndjson"):
+                self.export_ndjson()
+            else:
+                self.export_json()
+        self.export_metrics = self.metrics
+        if self.settings.metrics_output:
+            self.export_metrics_json()
+
+    def export_metrics_json(self) -> None:
+        """Save phase metrics of each clash set and the export to ``settings.metrics_output``."""
+        metrics = {
+            "clash_sets": [{"name": c["name"], "metrics": c.get("metrics", {})} for c in self.clash_sets],
+            "export": self.export_metrics,
+        }
+        with open(self.settings.metrics_output, "w", encoding="utf-8") as metrics_file:
+            json.dump(metrics, metrics_file, indent=4)
 
     def export_bcfxml(self) -> None:
+        """Save one BCF per clash set, with a topic per clash or per smart group.
+
+        Topics are streamed into the archive by :class:`BcfWriter`. If
+        :meth:`get_viewpoint_snapshot` is overloaded, topics are built with
+        ``bcf-client`` instead so that snapshots can be added.
+        """
+        if type(self).get_viewpoint_snapshot is not Clasher.get_viewpoint_snapshot:
+            return self.export_bcfxml_with_snapshots()
+
+        from .bcf_writer import BcfWriter
+
+        for i, clash_set in enumerate(self.clash_sets):
+            suffix = f".{i}" if i else ""
+            with BcfWriter(f"{self.settings.output}{suffix}", clash_set["name"]) as writer:
+                clashes = clash_set.get("clashes", {})
+                if self.settings.bcf_topics == "smart_group":
+                    self.write_bcf_smart_groups(writer, clash_set["name"], clashes)
+                    continue
+                for clash_id, clash in clashes.items():
+                    title = f'{clash["a_ifc_class"]}/{clash["a_name"]} and {clash["b_ifc_class"]}/{clash["b_name"]}'
+                    writer.add_topic(clash_id, title, title, clash["p1"], (clash["a_global_id"], clash["b_global_id"]))
+
+    def write_bcf_smart_groups(self, writer, name: str, clashes: dict[str, ClashResult]) -> None:
+        """Write a topic per smart group, looking at the centre of its clash points.
+
+        Clashes that were not smart grouped get a topic each.
+        """
+        groups: dict[Union[int, str], list[ClashResult]] = {}
+        for clash_id, clash in clashes.items():
+            groups.setdefault(clash.get("smart_group", clash_id), []).append(clash)
+        for i, (key, group) in enumerate(groups.items(), 1):
+            global_ids = list(dict.fromkeys(g for clash in group for g in (clash["a_global_id"], clash["b_global_id"])))
+            description = "\n".join(
+                f'{clash["a_ifc_class"]}/{clash["a_name"]} and {clash["b_ifc_class"]}/{clash["b_name"]}'
+                for clash in group
+            )
+            point = np.mean([clash["p1"] for clash in group], axis=0).tolist()
+            writer.add_topic(str(key), f"{name} - {i} ({len(group)} clashes)", description, point, global_ids)
+
+    def export_bcfxml_with_snapshots(self) -> None:
         from bcf.v2.bcfxml import BcfXml
 
         for i, clash_set in enumerate(self.clash_sets):
@@ -247,14 +1024,29 @@ class Clasher:
         clash_sets = self.clash_sets.copy()
         for clash_set in clash_sets:
             for source in clash_set["a"]:
-                del source["ifc"]
+                source.pop("ifc", None)
             for source in clash_set.get("b", []):
-                del source["ifc"]
+                source.pop("ifc", None)
         with open(self.settings.output, "w", encoding="utf-8") as clashes_file:
-            json.dump(clash_sets, clashes_file, indent=4)
+            if self.settings.compact:
+                json.dump(clash_sets, clashes_file, separators=(",", ":"))
+            else:
+                json.dump(clash_sets, clashes_file, indent=4)
+
+    def export_ndjson(self) -> None:
+        """Save clash results as one JSON object per line, tagged with its clash set name.
+
+        If the clashes were already streamed during :meth:`clash`, this does nothing.
+        """
+        if self.is_streamed:
+            return
+        with open(self.settings.output, "w", encoding="utf-8") as self.stream:
+            for clash_set in self.clash_sets:
+                for clash_id, clash in clash_set.get("clashes", {}).items():
+                    self.write_clash(clash_set, clash_id, clash)
+        self.stream = None
 
     def smart_group_clashes(self, clash_sets: list[ClashSet], max_clustering_distance: float):
-        from sklearn.cluster import OPTICS
         from collections import defaultdict
 
         count_of_input_clashes = 0
@@ -279,11 +1071,7 @@ class Clasher:
 
             count_of_input_clashes += len(clashes)
 
-            positions = []
-            for clash in clashes.values():
-                positions.append(clash["position"])
-
-            data = np.array(positions)
+            data = np.array([clash["p1"] for clash in clashes.values()], dtype=float)
 
             # INPUTS
             # set the desired maximum distance between the grouped points
@@ -292,23 +1080,11 @@ class Clasher:
             else:
                 max_distance_between_grouped_points = 3
 
-            model = OPTICS(
-                min_samples=2, max_eps=max_distance_between_grouped_points)
-            model.fit_predict(data)
-            pred = model.fit_predict(data)
-
-            # Insert the smart groups into the clashes
-            if len(pred) == len(clashes.values()):
-                i = 0
-                for clash in clashes.values():
-                    int_prediction = int(pred[i])
-                    if int_prediction == -1:
-                        # ungroup this clash since it's a single clash that we were not able to group.
-                        new_clash_group_number = np.amax(pred).item() + 1 + i
-                        clash["smart_group"] = new_clash_group_number
-                    else:
-                        clash["smart_group"] = int_prediction
-                    i += 1
+            pred = self.cluster_points(data, max_distance_between_grouped_points)
+
+            # Insert the smart groups into the clashes. Clashes that could not be grouped get their own group.
+            for clash, prediction in zip(clashes.values(), pred.tolist()):
+                clash["smart_group"] = prediction
 
         # Create JSON with smart_groups that contain GlobalIDs
         output_clash_sets = defaultdict(list)
@@ -346,7 +1122,160 @@ class Clasher:
         return output_clash_sets
 
 
+    def cluster_points(self, points: np.ndarray, max_distance: float) -> np.ndarray:
+        """Single-linkage cluster points, linking any two within ``max_distance``.
+
+        Points are hashed into cells small enough that all points in a cell are
+        linked, so only neighbouring cells need pairwise distance checks. One
+        linked point pair is enough to join two cells, so checks stop at the
+        first link and memory stays bounded however dense a cell is.
+
+        :return: A cluster label from 0 for each point.
+        """
+        if not len(points):
+            return np.zeros(0, dtype=int)
+        # Upper bound of point pairs compared at once.
+        max_pairs = 1 << 18
+        # Cell pairs with more point pairs than this are checked one by one.
+        max_dense_pairs = 4096
+
+        cell_size = max_distance / np.sqrt(3)
+        cells = np.floor(points / cell_size).astype(np.int64)
+        # Pad by the neighbour reach so that offset cells stay in range.
+        reach = int(np.ceil(max_distance / cell_size))
+        cells -= cells.min(axis=0) - reach
+        dims = cells.max(axis=0) + reach + 1
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+        order = np.argsort(keys, kind="stable")
+        cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        sorted_points = points[order]
+
+        cell_pairs = []
+        r = range(-reach, reach + 1)
+        for offset in ((x, y, z) for x in r for y in r for z in r if (x, y, z) > (0, 0, 0)):
+            gap = cell_size * np.maximum(np.abs(offset) - 1, 0)
+            if np.dot(gap, gap) > max_distance**2:
+                continue
+            neighbour_keys = cell_keys + (offset[0] * dims[1] + offset[1]) * dims[2] + offset[2]
+            j = np.minimum(np.searchsorted(cell_keys, neighbour_keys), len(cell_keys) - 1)
+            i = np.flatnonzero(cell_keys[j] == neighbour_keys)
+            cell_pairs.append(np.stack((i, j[i])))
+        i, j = np.concatenate(cell_pairs, axis=1)
+        pair_counts = counts[i] * counts[j]
+        dense = pair_counts > max_dense_pairs
+
+        # Enumerate every point pair between sparse neighbouring cells, a bounded chunk at a time.
+        edges = []
+        sparse = np.flatnonzero(~dense)
+        chunk_ends = np.searchsorted(np.cumsum(pair_counts[sparse]), np.arange(max_pairs, pair_counts.sum() + max_pairs, max_pairs))
+        for chunk in np.split(sparse, np.unique(chunk_ends[chunk_ends < len(sparse)])):
+            if not len(chunk):
+                continue
+            ci, cj, chunk_counts = i[chunk], j[chunk], pair_counts[chunk]
+            pair_cell = np.repeat(np.arange(len(chunk)), chunk_counts)
+            pair_offset = np.arange(chunk_counts.sum()) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            a = starts[ci][pair_cell] + pair_offset // counts[cj][pair_cell]
+            b = starts[cj][pair_cell] + pair_offset % counts[cj][pair_cell]
+            linked = np.sum((sorted_points[a] - sorted_points[b]) ** 2, axis=1) <= max_distance**2
+            linked_cells = np.unique(pair_cell[linked])
+            edges.append(np.stack((ci[linked_cells], cj[linked_cells])))
+
+        cell_labels = np.arange(len(cell_keys))
+        if edges:
+            u, v = np.concatenate(edges, axis=1)
+            # Propagate the smallest label through the edges until the components are stable.
+            while True:
+                minimum = np.minimum(cell_labels[u], cell_labels[v])
+                new_labels = cell_labels.copy()
+                np.minimum.at(new_labels, u, minimum)
+                np.minimum.at(new_labels, v, minimum)
+                new_labels = new_labels[new_labels]
+                if np.array_equal(new_labels, cell_labels):
+                    break
+                cell_labels = new_labels
+
+        # Dense cells are joined with a union-find, skipping pairs that are already connected.
+        parents = np.arange(len(cell_keys))
+
+        def find(label: int) -> int:
+            while parents[label] != label:
+                parents[label] = parents[parents[label]]
+                label = parents[label]
+            return label
+
+        for a, b in zip(i[dense].tolist(), j[dense].tolist()):
+            root_a, root_b = find(cell_labels[a]), find(cell_labels[b])
+            if root_a == root_b:
+                continue
+            a_points = sorted_points[starts[a] : starts[a] + counts[a]]
+            b_points = sorted_points[starts[b] : starts[b] + counts[b]]
+            if self.are_points_linked(a_points, b_points, max_distance, max_pairs):
+                parents[max(root_a, root_b)] = min(root_a, root_b)
+        cell_labels = np.array([find(label) for label in cell_labels.tolist()])
+
+        labels = np.empty(len(points), dtype=int)
+        labels[order] = np.repeat(cell_labels, counts)
+        return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+    def are_points_linked(self, a: np.ndarray, b: np.ndarray, max_distance: float, max_pairs: int) -> bool:
+        """Return whether any point of ``a`` is within ``max_distance`` of any point of ``b``."""
+        # Only points within reach of the other set's bounding box can be linked.
+        a = a[np.all((a >= b.min(axis=0) - max_distance) & (a <= b.max(axis=0) + max_distance), axis=1)]
+        if not len(a):
+            return False
+        b = b[np.all((b >= a.min(axis=0) - max_distance) & (b <= a.max(axis=0) + max_distance), axis=1)]
+        if not len(b):
+            return False
+        step = max(1, max_pairs // len(b))
+        for start in range(0, len(a), step):
+            offsets = a[start : start + step, None, :] - b[None, :, :]
+            if (np.einsum("ijk,ijk->ij", offsets, offsets) <= max_distance**2).any():
+                return True
+        return False
+
+
 class ClashSettings:
     def __init__(self):
         self.logger: Logger = None
         self.output = "clashes.json"
+        # Previous clash results to update incrementally instead of clashing everything.
+        self.previous_output: Union[None, str] = None
+        # Previous revisions of changed IFC files, keyed by their current path.
+        self.previous_files: dict[str, str] = {}
+        # Clash in XY tiles of this size to bound memory. Disabled if None.
+        self.tile_size: Union[None, float] = None
+        # Filter elements by bounding box before the narrow phase.
+        self.broad_phase = False
+        # Write JSON without indentation or whitespace.
+        self.compact = False
+        # Number of worker processes used to process clash sets.
+        self.jobs = 1
+        # Tessellation threads per iterator. Defaults to the CPU count if None.
+        self.threads: Union[None, int] = None
+        # Sidecar JSON file for phase metrics. Metrics are always included in the JSON output.
+        self.metrics_output: Union[None, str] = None
+        # Capture a "cprofile" or "tracemalloc" profile of the clash in the main process.
+        self.profile: Union[None, Literal["cprofile", "tracemalloc"]] = None
+        self.profile_output: Union[None, str] = None
+        # Write a BCF topic per "clash", or per "smart_group" of grouped clashes.
+        self.bcf_topics: Literal["clash", "smart_group"] = "clash"
+        # The 0-based (index, count) shard of each clash set to process, see shard.py. Disabled if None.
+        # Shards split group A by GlobalId range, or split tiles if tile_size is set.
+        self.shard: Union[None, tuple[int, int]] = None
+
+
+_clasher: Union[None, Clasher] = None
+
+
+def _init_clash_worker(clasher_class: type[Clasher], settings: ClashSettings) -> None:
+    global _clasher
+    # Share the CPUs between workers rather than oversubscribing tessellation threads.
+    settings.threads = settings.threads or max(1, multiprocessing.cpu_count() // settings.jobs)
+    _clasher = clasher_class(settings)
+
+
+def _process_clash_set(clash_set: ClashSet) -> tuple[dict[str, ClashResult], dict[str, PhaseMetrics]]:
+    assert _clasher
+    _clasher.process_clash_set(clash_set)
+    return clash_set["clashes"], clash_set["metrics"]
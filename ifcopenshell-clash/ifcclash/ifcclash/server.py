@@ -0,0 +1,150 @@
+# IfcClash - IFC-based clash detection.
+# Copyright (C) 2020-2024 Dion Moult <dion@thinkmoult.com>
+#
+# This file is part of IfcClash.
+#
+# IfcClash is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# IfcClash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with IfcClash.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+import os
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from .ifcclash import Clasher, ClashSet, ClashSettings
+
+# Settings required by each clash mode, with their expected types.
+MODE_SETTINGS = {
+    "intersection": {"tolerance": (int, float), "check_all": bool},
+    "collision": {"allow_touching": bool},
+    "clearance": {"clearance": (int, float), "check_all": bool},
+}
+
+
+class ClashServer(HTTPServer):
+    """A local HTTP service that keeps a :class:`Clasher` warm between requests.
+
+    Opened IFCs, selected sources and populated trees are reused by every
+    request until one of their files is modified on disk. Requests are
+    handled one at a time.
+    """
+
+    def __init__(self, address: tuple[str, int], settings: ClashSettings):
+        super().__init__(address, ClashRequestHandler)
+        self.settings = settings
+        self.clasher = Clasher(settings)
+        self.mtimes: dict[str, float] = {}
+
+    def clash(self, clash_sets: list[ClashSet]) -> list[ClashSet]:
+        paths = {s["file"] for clash_set in clash_sets for s in clash_set["a"] + clash_set.get("b", [])}
+        self.refresh(paths)
+        self.clasher.clash_sets = clash_sets
+        self.clasher.clash()
+        for clash_set in clash_sets:
+            for source in clash_set["a"] + clash_set.get("b", []):
+                source.pop("ifc", None)
+        return clash_sets
+
+    def refresh(self, paths: set[str]) -> None:
+        """Drop all warm state if any of the requested files changed since it was loaded."""
+        mtimes = {path: os.path.getmtime(path) for path in paths}
+        if any(self.mtimes.get(path, mtime) != mtime for path, mtime in mtimes.items()):
+            self.settings.logger.info("Model changed on disk, discarding loaded models")
+            self.clasher = Clasher(self.settings)
+            self.mtimes = {}
+        self.mtimes.update(mtimes)
+
+    def get_status(self) -> dict:
+        return {"files": sorted(self.clasher.ifcs), "trees": len(self.clasher.trees)}
+
+
+class ClashRequestHandler(BaseHTTPRequestHandler):
+    server: ClashServer
+
+    def do_GET(self) -> None:
+        if self.path != "/status":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        self.send_json(200, self.server.get_status())
+
+    def do_POST(self) -> None:
+        """Clash a clash set, or a list of clash sets, posted as JSON to ``/clash``."""
+        if self.path != "/clash":
+            return self.send_json(404, {"error": f"Unknown path {self.path}"})
+        try:
+            clash_sets = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            return self.send_json(400, {"error": f"Invalid JSON: {e}"})
+        if isinstance(clash_sets, dict):
+            clash_sets = [clash_sets]
+        try:
+            validate_clash_sets(clash_sets)
+        except ValueError as e:
+            return self.send_json(400, {"error": f"Invalid clash set: {e}"})
+        try:
+            self.send_json(200, self.server.clash(clash_sets))
+        except Exception as e:
+            self.server.settings.logger.exception("Clash failed")
+            self.send_json(500, {"error": str(e)})
+
+    def send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        self.server.settings.logger.info(format % args)
+
+
+def validate_clash_sets(clash_sets) -> None:
+    """Check that posted clash sets can be clashed, raising a ValueError describing the first problem."""
+    if not isinstance(clash_sets, list):
+        raise ValueError("expected a clash set or a list of clash sets")
+    for i, clash_set in enumerate(clash_sets):
+        if not isinstance(clash_set, dict):
+            raise ValueError(f"clash set {i} is not an object")
+        name = clash_set.get("name")
+        if not isinstance(name, str):
+            raise ValueError(f"clash set {i} has no name")
+        if not clash_set.get("a"):
+            raise ValueError(f"{name} has no sources in a")
+        for group in ("a", "b"):
+            sources = clash_set.get(group, [])
+            if not isinstance(sources, list):
+                raise ValueError(f"{name} {group} is not a list of sources")
+            for source in sources:
+                if not isinstance(source, dict) or not isinstance(source.get("file"), str):
+                    raise ValueError(f"{name} {group} has a source without a file")
+                if not os.path.isfile(source["file"]):
+                    raise ValueError(f"{name} {group} file {source['file']} does not exist")
+                if source.get("mode") not in (None, "a", "e", "i"):
+                    raise ValueError(f"{name} {group} has an unknown source mode {source['mode']!r}")
+                if not isinstance(source.get("selector") or "", str):
+                    raise ValueError(f"{name} {group} has a selector that is not a string")
+        mode = clash_set.get("mode")
+        if mode not in MODE_SETTINGS:
+            raise ValueError(f"{name} has an unknown mode {mode!r}, expected one of {', '.join(MODE_SETTINGS)}")
+        for key, types in MODE_SETTINGS[mode].items():
+            value = clash_set.get(key)
+            if isinstance(value, bool) != (types is bool) or not isinstance(value, types):
+                raise ValueError(f"{name} requires {key} in {mode} mode")
+
+
+def serve(settings: ClashSettings, host: str = "127.0.0.1", port: int = 8000) -> None:
+    server = ClashServer((host, port), settings)
+    settings.logger.info(f"Serving clashes on http://{host}:{port}/clash")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
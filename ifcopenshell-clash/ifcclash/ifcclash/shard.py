@@ -0,0 +1,149 @@
+# IfcClash - IFC-based clash detection.
+# Copyright (C) 2020-2024 Dion Moult <dion@thinkmoult.com>
+#
+# This file is part of IfcClash.
+#
+# IfcClash is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# IfcClash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with IfcClash.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Split clash sets into shards that separate processes or machines clash independently.
+
+A coordinator writes one manifest per shard into a directory on a shared
+filesystem. Each worker runs ``python -m ifcclash --shard-dir DIR --shard K/N``
+and writes its output next to its manifest. Once every worker is done,
+``python -m ifcclash --shard-dir DIR --merge-shards N`` combines the outputs.
+"""
+
+from __future__ import annotations
+import os
+import copy
+import json
+from typing import Union
+from .ifcclash import Clasher, ClashSet, ClashSettings, PhaseMetrics
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse a 1-based ``K/N`` shard into a 0-based ``(index, count)``."""
+    try:
+        k, n = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value}, expected K/N")
+    if not 1 <= k <= n:
+        raise ValueError(f"Invalid shard {value}, expected K/N with 1 <= K <= N")
+    return k - 1, n
+
+
+def get_manifest_path(directory: str, index: int, count: int) -> str:
+    return os.path.join(directory, f"shard-{index + 1}-of-{count}.json")
+
+
+def get_output_path(directory: str, index: int, count: int) -> str:
+    return os.path.join(directory, f"output-{index + 1}-of-{count}.json")
+
+
+def write_shard_manifests(
+    clash_sets: list[ClashSet], directory: str, count: int, tile_size: Union[None, float] = None
+) -> list[str]:
+    """Write a manifest for each of ``count`` shards and return their paths.
+
+    Source paths are made absolute so workers may run from any directory that
+    sees the same filesystem. If ``tile_size`` is set, shards split tiles
+    instead of group A. Outputs left by an earlier run with the same count
+    are removed, so they can't be merged with the new run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    clash_sets = copy.deepcopy(clash_sets)
+    for clash_set in clash_sets:
+        for source in clash_set["a"] + clash_set.get("b", []):
+            source["file"] = os.path.abspath(source["file"])
+    paths = []
+    for index in range(count):
+        manifest = {
+            "shard": f"{index + 1}/{count}",
+            "tile_size": tile_size,
+            "output": os.path.basename(get_output_path(directory, index, count)),
+            "clash_sets": clash_sets,
+        }
+        path = get_manifest_path(directory, index, count)
+        with open(path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        paths.append(path)
+        output = get_output_path(directory, index, count)
+        if os.path.exists(output):
+            os.remove(output)
+    return paths
+
+
+def run_shard(settings: ClashSettings, directory: str, index: int, count: int) -> str:
+    """Clash one shard from its manifest and return the path of its output.
+
+    The output is written under a temporary name and renamed once complete,
+    so a merge never reads a partial shard.
+    """
+    with open(get_manifest_path(directory, index, count), "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    output = os.path.join(directory, manifest["output"])
+    settings.shard = (index, count)
+    settings.tile_size = manifest["tile_size"]
+    settings.output = output[: -len(".json")] + ".partial.json"
+    clasher = Clasher(settings)
+    clasher.clash_sets = manifest["clash_sets"]
+    clasher.clash()
+    clasher.export()
+    os.replace(settings.output, output)
+    return output
+
+
+def merge_shards(directory: str, count: int) -> list[ClashSet]:
+    """Combine the outputs of the ``count`` shards in ``directory`` into one list of clash sets.
+
+    Only manifests of ``count`` shards are read, so manifests of an earlier
+    run with another count are ignored. Every shard must have a manifest and
+    an output. Clashes found by several shards, such as pairs spanning tiles,
+    are only kept once. Phase times and counts are summed, and peak RSS is
+    the largest of any shard.
+    """
+    merged: dict[str, ClashSet] = {}
+    for index in range(count):
+        manifest_path = get_manifest_path(directory, index, count)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"Shard {index + 1}/{count} has no manifest: {manifest_path}")
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        output = os.path.join(directory, manifest["output"])
+        if not os.path.exists(output):
+            raise FileNotFoundError(f"Shard {manifest['shard']} has no output yet: {output}")
+        with open(output, "r", encoding="utf-8") as output_file:
+            clash_sets: list[ClashSet] = json.load(output_file)
+        for clash_set in clash_sets:
+            merged_clash_set = merged.get(clash_set["name"], None)
+            if merged_clash_set is None:
+                merged[clash_set["name"]] = clash_set
+                continue
+            merged_clash_set.setdefault("clashes", {}).update(clash_set.get("clashes", {}))
+            merged_clash_set["metrics"] = merge_metrics(merged_clash_set.get("metrics", {}), clash_set.get("metrics", {}))
+    return list(merged.values())
+
+
+def merge_metrics(metrics1: dict[str, PhaseMetrics], metrics2: dict[str, PhaseMetrics]) -> dict[str, PhaseMetrics]:
+    metrics = copy.deepcopy(metrics1)
+    for phase, phase_metrics in metrics2.items():
+        if phase not in metrics:
+            metrics[phase] = copy.deepcopy(phase_metrics)
+            continue
+        for key, value in phase_metrics.items():
+            if key == "peak_rss":
+                metrics[phase][key] = max(metrics[phase].get(key, 0), value)
+            else:
+                metrics[phase][key] = metrics[phase].get(key, 0) + value
+    return metrics
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import the ifcclash package from this checkout, as python -m ifcclash does.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
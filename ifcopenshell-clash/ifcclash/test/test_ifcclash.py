@@ -0,0 +1,166 @@
+# IfcClash - IFC-based clash detection.
+# Copyright (C) 2020-2024 Dion Moult <dion@thinkmoult.com>
+#
+# This file is part of IfcClash.
+#
+# IfcClash is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# IfcClash is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with IfcClash.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import logging
+import numpy as np
+import ifcopenshell
+import ifcopenshell.api.aggregate
+import ifcopenshell.api.context
+import ifcopenshell.api.geometry
+import ifcopenshell.api.project
+import ifcopenshell.api.root
+import ifcopenshell.api.spatial
+import ifcopenshell.api.unit
+from ifcclash.ifcclash import Clasher, ClashSettings
+
+
+def create_model(storeys: dict[str, float], unit: str = "METRE") -> ifcopenshell.file:
+    ifc = ifcopenshell.api.project.create_file(version="IFC4")
+    project = ifcopenshell.api.root.create_entity(ifc, ifc_class="IfcProject")
+    prefix = "MILLI" if unit == "MILLIMETRE" else None
+    length = ifcopenshell.api.unit.add_si_unit(ifc, unit_type="LENGTHUNIT", prefix=prefix)
+    ifcopenshell.api.unit.assign_unit(ifc, units=[length])
+    model = ifcopenshell.api.context.add_context(ifc, context_type="Model")
+    ifcopenshell.api.context.add_context(ifc, "Model", "Body", "MODEL_VIEW", parent=model)
+    site = ifcopenshell.api.root.create_entity(ifc, ifc_class="IfcSite")
+    building = ifcopenshell.api.root.create_entity(ifc, ifc_class="IfcBuilding")
+    ifcopenshell.api.aggregate.assign_object(ifc, relating_object=project, products=[site])
+    ifcopenshell.api.aggregate.assign_object(ifc, relating_object=site, products=[building])
+    for name, elevation in storeys.items():
+        storey = ifcopenshell.api.root.create_entity(ifc, ifc_class="IfcBuildingStorey", name=name)
+        storey.Elevation = elevation
+        ifcopenshell.api.aggregate.assign_object(ifc, relating_object=building, products=[storey])
+    return ifc
+
+
+def add_wall(ifc: ifcopenshell.file, storey_name: str, matrix: np.ndarray) -> ifcopenshell.entity_instance:
+    body = ifc.by_type("IfcGeometricRepresentationSubContext")[0]
+    wall = ifcopenshell.api.root.create_entity(ifc, ifc_class="IfcWall")
+    representation = ifcopenshell.api.geometry.add_wall_representation(
+        ifc, context=body, length=5.0, height=3.0, thickness=0.2
+    )
+    ifcopenshell.api.geometry.assign_representation(ifc, product=wall, representation=representation)
+    ifcopenshell.api.geometry.edit_object_placement(ifc, product=wall, matrix=matrix)
+    storey = next(s for s in ifc.by_type("IfcBuildingStorey") if s.Name == storey_name)
+    ifcopenshell.api.spatial.assign_container(ifc, relating_structure=storey, products=[wall])
+    return wall
+
+
+def brute_force_clusters(points: np.ndarray, max_distance: float) -> np.ndarray:
+    offsets = points[:, None, :] - points[None, :, :]
+    linked = np.einsum("ijk,ijk->ij", offsets, offsets) <= max_distance**2
+    labels = np.arange(len(points))
+    while True:
+        new_labels = np.where(linked, labels[None, :], len(points)).min(axis=1)
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def assert_same_partition(labels: np.ndarray, expected: np.ndarray) -> None:
+    pairs = set(zip(labels.tolist(), expected.tolist()))
+    assert len(pairs) == len(set(labels.tolist())) == len(set(expected.tolist()))
+
+
+class TestClusterPoints:
+    def setup_method(self):
+        self.clasher = Clasher(ClashSettings())
+        self.rng = np.random.default_rng(0)
+
+    def test_no_points(self):
+        assert len(self.clasher.cluster_points(np.zeros((0, 3)), 3)) == 0
+
+    def test_matching_brute_force(self):
+        for scale in (5, 20, 100):
+            points = self.rng.uniform(0, scale, (800, 3))
+            assert_same_partition(self.clasher.cluster_points(points, 3), brute_force_clusters(points, 3))
+
+    def test_matching_brute_force_with_dense_clusters(self):
+        centres = self.rng.uniform(0, 30, (6, 3))
+        points = (centres[:, None, :] + self.rng.normal(0, 0.2, (6, 300, 3))).reshape(-1, 3)
+        assert_same_partition(self.clasher.cluster_points(points, 1), brute_force_clusters(points, 1))
+
+    def test_dense_neighbouring_cells_out_of_reach(self):
+        points = self.rng.uniform(0, 0.2, (5000, 3))
+        points = np.concatenate((points, points + [3.3, 0, 0]))
+        labels = self.clasher.cluster_points(points, 3)
+        assert set(labels[:5000].tolist()) == {0}
+        assert set(labels[5000:].tolist()) == {1}
+
+    def test_dense_hotspots_in_seconds(self):
+        centres = self.rng.uniform(0, 500, (20, 3))
+        points = (centres[:, None, :] + self.rng.normal(0, 1, (20, 5000, 3))).reshape(-1, 3)
+        start = time.time()
+        labels = self.clasher.cluster_points(points, 3)
+        assert time.time() - start < 10
+        assert len(set(labels.tolist())) == 20
+
+    def test_dense_corridor_in_seconds(self):
+        points = np.column_stack((self.rng.uniform(0, 10, 20000), self.rng.uniform(0, 0.5, (20000, 2))))
+        start = time.time()
+        labels = self.clasher.cluster_points(points, 3)
+        assert time.time() - start < 10
+        assert set(labels.tolist()) == {0}
+
+
+class TestMaxStoreySeparation:
+    def setup_method(self):
+        self.settings = ClashSettings()
+        self.settings.logger = logging.getLogger("Clash")
+        self.clasher = Clasher(self.settings)
+
+    def clash(self, tmp_path, mep_storey: str) -> int:
+        structure = create_model({"Foundation": -1.5, "Level 0": 0.0, "Level 1": 3.5})
+        add_wall(structure, "Level 0", np.eye(4))
+        mep = create_model({"Level 0": 0.0, "Level 1": 3.5})
+        crossing = np.array([[0.0, -1.0, 0.0, 2.5], [1.0, 0.0, 0.0, -1.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+        add_wall(mep, mep_storey, crossing)
+        structure.write(str(tmp_path / "structure.ifc"))
+        mep.write(str(tmp_path / "mep.ifc"))
+        self.settings.output = str(tmp_path / "output.json")
+        self.clasher.clash_sets = [
+            {
+                "name": "Structure and MEP",
+                "a": [{"file": str(tmp_path / "structure.ifc")}],
+                "b": [{"file": str(tmp_path / "mep.ifc")}],
+                "mode": "intersection",
+                "tolerance": 0.002,
+                "check_all": True,
+                "max_storey_separation": 0,
+            }
+        ]
+        self.clasher.clash()
+        return len(self.clasher.clash_sets[0]["clashes"])
+
+    def test_matching_storeys_of_files_with_different_storeys(self, tmp_path):
+        assert self.clash(tmp_path, "Level 0") == 1
+
+    def test_excluding_other_storeys(self, tmp_path):
+        assert self.clash(tmp_path, "Level 1") == 0
+
+    def test_storey_elevations_in_project_units(self):
+        structure = create_model({"Foundation": -1.5, "Level 0": 0.0, "Level 1": 3.5})
+        mep = create_model({"Level 0": 20.0, "Level 1": 3480.0}, unit="MILLIMETRE")
+        levels = self.clasher.get_storey_levels({"a": [{"ifc": structure}], "b": [{"ifc": mep}]})
+        assert {(s.Name, levels[s]) for s in structure.by_type("IfcBuildingStorey")} == {
+            ("Foundation", 0),
+            ("Level 0", 1),
+            ("Level 1", 2),
+        }
+        assert {(s.Name, levels[s]) for s in mep.by_type("IfcBuildingStorey")} == {("Level 0", 1), ("Level 1", 2)}
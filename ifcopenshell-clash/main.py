@@ -1,58 +1,89 @@
 import click
 import json
+import logging
+import string
+import sys
 from pathlib import Path
-import subprocess
+
+sys.path.insert(0, str(Path(__file__).parent / 'ifcclash'))
+from ifcclash.ifcclash import Clasher, ClashSettings  # noqa: E402
+
+
+def build_clash_sets(files_a, files_b, selector_a='', selector_b='', mode='intersection', tolerance=0.01, check_all=True):
+    """Build one clash set per pair of files in ``files_a`` and ``files_b``."""
+    clash_sets = []
+    for i, (file_a, file_b) in enumerate(zip(files_a, files_b)):
+        clash_sets.append({
+            "name": f"Clash Set {string.ascii_uppercase[i] if i < 26 else i + 1}",
+            "a": [
+                {
+                    "file": file_a,
+                    "selector": selector_a
+                }
+            ],
+            "b": [
+                {
+                    "file": file_b,
+                    "selector": selector_b
+                }
+            ],
+            "mode": mode,
+            "tolerance": tolerance,
+            "check_all": check_all
+        })
+    return clash_sets
+
+
+def run_clash(clash_sets, output='output.json', logger=None):
+    """Clash and export clash sets in this interpreter, returning them with their clashes."""
+    settings = ClashSettings()
+    settings.output = output
+    if logger is None:
+        logger = logging.getLogger('Clash')
+        logger.setLevel(logging.INFO)
+        if not logger.handlers:
+            logger.addHandler(logging.StreamHandler(sys.stdout))
+    settings.logger = logger
+    clasher = Clasher(settings)
+    clasher.clash_sets = clash_sets
+    clasher.clash()
+    clasher.export()
+    return clasher.clash_sets
 
 
 @click.command()
-@click.option('--file-a', required=True, help='Path to first IFC file')
-@click.option('--file-b', required=True, help='Path to second IFC file')
+@click.option('--file-a', required=False, multiple=True, help='Path to first IFC file. Can be repeated to clash several pairs')
+@click.option('--file-b', required=False, multiple=True, help='Path to second IFC file. Can be repeated to clash several pairs')
 @click.option('--selector-a', default='', help='Selector for file A (default: all elements)')
 @click.option('--selector-b', default='', help='Selector for file B (default: all elements)')
 @click.option('--mode', default='intersection', help='Clash detection mode (default: intersection)')
 @click.option('--tolerance', default=0.01, type=float, help='Tolerance value (default: 0.01)')
 @click.option('--check-all', default=True, type=bool, help='Check all elements (default: True)')
-def create_clash_set(file_a, file_b, selector_a, selector_b, mode, tolerance, check_all):
-    """Create a clash sets JSON file for IFC clash detection."""
-
-    clash_set = {
-        "name": "Clash Set A",
-        "a": [
-            {
-                "file": f'../{file_a}',
-                "selector": selector_a
-            }
-        ],
-        "b": [
-            {
-                "file": f'../{file_b}',
-                "selector": selector_b
-            }
-        ],
-        "mode": mode,
-        "tolerance": tolerance,
-        "check_all": check_all
-    }
-
-    # Write the JSON file
-    with open('clash_sets.json', 'w') as f:
-        json.dump([clash_set], f, indent=2)
-
-    # Get the absolute path to the ifcclash directory
-    # Adjust this path to your ifcclash directory
-    ifcclash_dir = Path(__file__).parent / 'ifcclash'
-
-    result = subprocess.run(['python3', '-m', 'ifcclash', '../clash_sets.json', '--output', '../output.json'],
-                            capture_output=True,
-                            text=True,
-                            cwd=str(ifcclash_dir))
-    # Check if command was successful
-    if result.returncode == 0:
-        print("Command succeeded!")
-        print(result.stdout)
-    else:
+@click.option('--clash-sets', 'clash_sets_path', default=None, type=click.Path(exists=True), help='A clash sets JSON file to run in addition to the file pairs')
+@click.option('--output', default='output.json', help='Path to save the clash results (default: output.json)')
+def create_clash_set(file_a, file_b, selector_a, selector_b, mode, tolerance, check_all, clash_sets_path, output):
+    """Create clash sets for pairs of IFC files and run them in this process."""
+
+    if len(file_a) != len(file_b):
+        raise click.UsageError('--file-a and --file-b must be given the same number of times.')
+
+    clash_sets = build_clash_sets(file_a, file_b, selector_a, selector_b, mode, tolerance, check_all)
+    if clash_sets_path:
+        with open(clash_sets_path, 'r') as f:
+            clash_sets.extend(json.load(f))
+    if not clash_sets:
+        raise click.UsageError('Provide --file-a and --file-b, or --clash-sets.')
+
+    try:
+        clash_sets = run_clash(clash_sets, output)
+    except Exception as e:
         print("Command failed!")
-        print(result.stderr)
+        print(e)
+        sys.exit(1)
+
+    print("Command succeeded!")
+    for clash_set in clash_sets:
+        print(f"{clash_set['name']}: {len(clash_set.get('clashes', {}))} clashes")
 
 
 if __name__ == '__main__':
@@ -1,6 +1,16 @@
+import json
+import os
 import subprocess
+import tempfile
+import time
+import uuid
 import click
 
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker.py')
+QUEUE_DIRS = ('jobs', 'running', 'done')
+# A job that has crashed this many workers is failed instead of queued again
+MAX_ATTEMPTS = 3
+
 
 def convert_ifc_logic(ifc_path, output):
 
@@ -42,10 +52,230 @@ bpy.ops.export_scene.fbx(
     return True
 
 
+def read_manifest(manifest_path, formats=(), output_dir=None):
+    """
+    Read the conversion jobs of a manifest, with paths relative to the manifest made absolute.
+
+    A manifest is a list of jobs, each with an ``ifc_path`` and optionally the
+    ``outputs`` to export it to. Jobs without outputs are exported in every
+    one of ``formats`` to ``output_dir``, named after the IFC.
+    """
+    with open(manifest_path) as f:
+        entries = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for entry in entries:
+        outputs = [os.path.join(base_dir, o) for o in entry.get('outputs', [])]
+        jobs.append(get_batch_job(os.path.join(base_dir, entry['ifc_path']), outputs, formats, output_dir))
+    return jobs
+
+
+def get_batch_job(ifc_path, outputs=(), formats=(), output_dir=None):
+    outputs = list(outputs)
+    if not outputs:
+        if not formats or not output_dir:
+            raise click.UsageError(f'{ifc_path} has no outputs, pass --format and --output to export it.')
+        name = os.path.splitext(os.path.basename(ifc_path))[0]
+        outputs = [os.path.join(output_dir, f"{name}.{f.lstrip('.')}") for f in formats]
+    return {'ifc_path': os.path.abspath(ifc_path), 'outputs': [os.path.abspath(o) for o in outputs]}
+
+
+def convert_batch(jobs):
+    """
+    Convert every job in a single Blender session, importing each IFC once for all of its outputs.
+
+    The worker appends each result as soon as its job finishes. If Blender
+    exits early, the jobs it finished keep their results and the others fail.
+
+    :return: The result of each job with its status and timings.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        manifest_path = os.path.join(directory, 'manifest.json')
+        results_path = os.path.join(directory, 'results.jsonl')
+        with open(manifest_path, 'w') as f:
+            json.dump(jobs, f, indent=4)
+        error = 'Blender exited before this job finished'
+        try:
+            subprocess.run(['blender', '-b', '-P', WORKER_SCRIPT, '--', '--batch', manifest_path, results_path])
+        except Exception as e:
+            print(f'Error converting IFC models: {e}')
+            error = f'Blender failed to run: {e}'
+        results = read_results(results_path)
+    for job in jobs[len(results):]:
+        results.append(dict(job, status='failed', error=error, seconds=0.0))
+    return results
+
+
+def read_results(results_path):
+    """Read the results a batch worker wrote, ignoring a last line cut short by a crash."""
+    results = []
+    if not os.path.exists(results_path):
+        return results
+    with open(results_path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                break
+    return results
+
+
+def make_queue(queue_dir):
+    for name in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+
+def start_worker(queue_dir, max_jobs=0):
+    return subprocess.Popen(['blender', '-b', '-P', WORKER_SCRIPT, '--', queue_dir, str(max_jobs)])
+
+
+def serve_workers(queue_dir, count, max_jobs=0, max_attempts=MAX_ATTEMPTS):
+    """
+    Keep count Blender workers running against a queue directory until it is stopped.
+
+    Workers that exit, after max_jobs jobs or on a crash, are replaced. Jobs a
+    crashed worker was running are moved back to the queue, or failed once
+    they have crashed max_attempts workers. Jobs left running by workers of a
+    pool that was killed are requeued the same way on startup.
+    """
+    make_queue(queue_dir)
+    stop_path = os.path.join(queue_dir, 'stop')
+    if os.path.exists(stop_path):
+        os.remove(stop_path)
+    requeue_orphaned_jobs(queue_dir, max_attempts)
+    workers = [start_worker(queue_dir, max_jobs) for _ in range(count)]
+    try:
+        while not os.path.exists(stop_path):
+            for i, worker in enumerate(workers):
+                if worker.poll() is not None:
+                    requeue_jobs(queue_dir, worker.pid, max_attempts)
+                    workers[i] = start_worker(queue_dir, max_jobs)
+            time.sleep(1)
+    finally:
+        with open(stop_path, 'w'):
+            pass
+        for worker in workers:
+            worker.wait()
+
+
+def requeue_jobs(queue_dir, pid, max_attempts=MAX_ATTEMPTS):
+    """Queue the jobs a crashed worker was running again, counting its attempts, or fail those out of attempts."""
+    running_dir = os.path.join(queue_dir, 'running')
+    prefix = f'{pid}-'
+    for name in os.listdir(running_dir):
+        if not name.startswith(prefix):
+            continue
+        running_path = os.path.join(running_dir, name)
+        with open(running_path) as f:
+            job = json.load(f)
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] >= max_attempts:
+            job['status'] = 'failed'
+            job['error'] = f"Blender crashed {job['attempts']} times converting {job['ifc_path']}"
+            path = os.path.join(queue_dir, 'done', f"{job['id']}.json")
+        else:
+            path = os.path.join(queue_dir, 'jobs', name[len(prefix):])
+        with open(path + '.partial', 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(path + '.partial', path)
+        os.remove(running_path)
+
+
+def requeue_orphaned_jobs(queue_dir, max_attempts=MAX_ATTEMPTS):
+    """Requeue the jobs of every worker that is no longer running, counting the attempt."""
+    pids = {name.split('-', 1)[0] for name in os.listdir(os.path.join(queue_dir, 'running'))}
+    for pid in pids:
+        if pid.isdigit() and not is_running(int(pid)):
+            requeue_jobs(queue_dir, int(pid), max_attempts)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit_job(queue_dir, ifc_path, output):
+    """Queue a conversion for the worker pool and return its job ID."""
+    make_queue(queue_dir)
+    job_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    job = {'id': job_id, 'ifc_path': os.path.abspath(ifc_path), 'output': os.path.abspath(output)}
+    path = os.path.join(queue_dir, 'jobs', f'{job_id}.json')
+    with open(path + '.partial', 'w') as f:
+        json.dump(job, f, indent=4)
+    os.replace(path + '.partial', path)
+    return job_id
+
+
+def wait_for_job(queue_dir, job_id, timeout=None):
+    """Wait for a queued conversion and return its result, or None if it timed out."""
+    path = os.path.join(queue_dir, 'done', f'{job_id}.json')
+    start = time.perf_counter()
+    while not os.path.exists(path):
+        if timeout is not None and time.perf_counter() - start > timeout:
+            return None
+        time.sleep(0.2)
+    with open(path) as f:
+        result = json.load(f)
+    os.remove(path)
+    return result
+
+
 @click.command()
-@click.option('--ifc-path', type=click.Path(exists=True), required=True, help='Path to the input IFC file.')
-@click.option('--output', type=click.Path(), required=True, help='Path to the output directory.')
-def convert_ifc(ifc_path, output):
+@click.option('--ifc-path', type=click.Path(exists=True), help='Path to the input IFC file.')
+@click.option('--output', type=click.Path(), help='Path to the output directory.')
+@click.option('--manifest', type=click.Path(exists=True), help='A JSON list of jobs to convert in one Blender session.')
+@click.option('--format', 'formats', multiple=True, help='Format to export to, such as obj or fbx. Repeat for several. --output is then a directory.')
+@click.option('--serve', 'serve_dir', type=click.Path(), help='Keep a pool of Blender workers converting jobs queued in this directory.')
+@click.option('--workers', default=2, type=int, help='Number of Blender workers to keep running with --serve (default: 2).')
+@click.option('--max-jobs', default=0, type=int, help='Restart each worker after this many jobs (default: never).')
+@click.option('--max-attempts', default=MAX_ATTEMPTS, type=int, help=f'Fail a job once it has crashed this many workers (default: {MAX_ATTEMPTS}).')
+@click.option('--queue', 'queue_dir', type=click.Path(), help='Convert with the worker pool serving this directory instead of launching Blender.')
+@click.option('--timeout', default=None, type=float, help='Seconds to wait for a queued conversion (default: no limit).')
+def convert_ifc(ifc_path, output, manifest, formats, serve_dir, workers, max_jobs, max_attempts, queue_dir, timeout):
+    if serve_dir:
+        click.echo(f'Serving {workers} workers for jobs queued in {serve_dir}.')
+        serve_workers(serve_dir, workers, max_jobs, max_attempts)
+        return
+
+    if manifest or formats:
+        if manifest:
+            jobs = read_manifest(manifest, formats, output)
+        elif ifc_path:
+            jobs = [get_batch_job(ifc_path, formats=formats, output_dir=output)]
+        else:
+            raise click.UsageError('--format needs --ifc-path or --manifest.')
+        start = time.perf_counter()
+        results = convert_batch(jobs)
+        for result in results:
+            name = os.path.basename(result['ifc_path'])
+            if result['status'] != 'succeeded':
+                click.echo(f"{name}: failed after {result['seconds']:.2f}s: {result.get('error')}")
+                continue
+            timings = result['timings']
+            exports = ', '.join(f'{os.path.basename(o)} in {s:.2f}s' for o, s in timings['exports'].items())
+            click.echo(f"{name}: imported in {timings['import']:.2f}s, exported {exports}")
+        failed = sum(1 for r in results if r['status'] != 'succeeded')
+        click.echo(f'Converted {len(results) - failed} of {len(results)} IFC files in {time.perf_counter() - start:.2f}s.')
+        return
+
+    if not ifc_path or not output:
+        raise click.UsageError('--ifc-path and --output are required.')
+
+    if queue_dir:
+        job = wait_for_job(queue_dir, submit_job(queue_dir, ifc_path, output), timeout)
+        if job is None:
+            click.echo('Conversion timed out.')
+        elif job['status'] == 'succeeded':
+            click.echo(f"Conversion completed successfully in {job['seconds']:.2f}s.")
+        else:
+            click.echo(f"Conversion failed: {job.get('error')}")
+        return
+
     # Delegate conversion logic to our converter module
     result = convert_ifc_logic(ifc_path, output)
     if result:
@@ -0,0 +1,160 @@
+"""
+Blender side of the conversion worker pool and batch conversions.
+
+Run as ``blender -b -P worker.py -- QUEUE_DIR [MAX_JOBS]``. Bonsai is enabled
+once, then jobs are claimed from QUEUE_DIR/jobs until the worker is stopped or
+has run MAX_JOBS jobs, so Blender startup and addon registration are only paid
+once per worker.
+
+Run as ``blender -b -P worker.py -- --batch MANIFEST RESULTS`` to convert every
+job of a manifest in this session, appending the result and timings of each
+job to RESULTS as a JSON line once it finishes.
+"""
+import bpy
+import json
+import os
+import sys
+import time
+import traceback
+
+POLL_INTERVAL = 0.2
+
+
+def export_obj(output):
+    bpy.ops.wm.obj_export(filepath=output)
+
+
+def export_fbx(output):
+    bpy.ops.export_scene.fbx(
+        filepath=output,
+        use_selection=False,        # Set True to export selected objects only
+        apply_unit_scale=True,      # Respects Blender's unit setup
+        global_scale=1.0,           # Adjust scale if needed
+        axis_forward='-Z',          # Common for game engines (e.g., Unity/Unreal)
+        axis_up='Y'
+    )
+
+
+EXPORTERS = {
+    '.obj': export_obj,
+    '.fbx': export_fbx,
+}
+
+
+def enable_bonsai():
+    if not bpy.context.preferences.addons.get('bonsai'):
+        bpy.ops.preferences.addon_enable(module='bonsai')
+        bpy.ops.wm.save_userpref()
+
+
+def reset_scene():
+    # Loading the empty home file also purges Bonsai's IfcStore through its load_post handler
+    bpy.ops.wm.read_homefile(use_empty=True)
+
+
+def convert(ifc_path, outputs):
+    """
+    Import an IFC once and export it to every output, in a format chosen by extension.
+
+    :return: The seconds taken to import, and to export each output.
+    """
+    exporters = []
+    for output in outputs:
+        exporter = EXPORTERS.get(os.path.splitext(output)[1].lower())
+        if exporter is None:
+            raise ValueError(f'Unsupported output format: {output}')
+        exporters.append((output, exporter))
+    start = time.perf_counter()
+    bpy.ops.bim.load_project(filepath=ifc_path)
+    timings = {'import': time.perf_counter() - start, 'exports': {}}
+    for output, exporter in exporters:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        start = time.perf_counter()
+        exporter(output)
+        timings['exports'][output] = time.perf_counter() - start
+    return timings
+
+
+def claim_job(queue_dir):
+    """
+    Move the oldest queued job into running, or return None if there is none.
+
+    Claimed jobs are prefixed with the worker's PID, so the pool can requeue
+    them if the worker crashes.
+    """
+    jobs_dir = os.path.join(queue_dir, 'jobs')
+    for name in sorted(os.listdir(jobs_dir)):
+        if not name.endswith('.json'):
+            continue
+        running_path = os.path.join(queue_dir, 'running', f'{os.getpid()}-{name}')
+        try:
+            # Renaming is atomic, so only one worker claims each job
+            os.rename(os.path.join(jobs_dir, name), running_path)
+        except FileNotFoundError:
+            continue
+        with open(running_path) as f:
+            return running_path, json.load(f)
+    return None
+
+
+def run(job):
+    """Convert a job and return it with its status and timings, leaving an empty scene for the next one."""
+    start = time.perf_counter()
+    result = dict(job)
+    try:
+        result['timings'] = convert(job['ifc_path'], job.get('outputs') or [job['output']])
+        result['status'] = 'succeeded'
+    except Exception as e:
+        traceback.print_exc()
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    finally:
+        reset_scene()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_job(queue_dir, running_path, job):
+    result = dict(run(job), worker=os.getpid())
+    done_path = os.path.join(queue_dir, 'done', f"{job['id']}.json")
+    with open(done_path + '.partial', 'w') as f:
+        json.dump(result, f, indent=4)
+    os.replace(done_path + '.partial', done_path)
+    os.remove(running_path)
+
+
+def run_batch(manifest_path, results_path):
+    with open(manifest_path) as f:
+        jobs = json.load(f)
+    with open(results_path, 'a') as f:
+        for job in jobs:
+            result = run(job)
+            # Written as soon as each job finishes, so a crash keeps the results before it
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            print(f"Converted {job['ifc_path']} ({result['status']}) in {result['seconds']:.2f}s")
+
+
+def main(argv):
+    if argv and argv[0] == '--batch':
+        enable_bonsai()
+        run_batch(argv[1], argv[2])
+        return
+    queue_dir = argv[0]
+    max_jobs = int(argv[1]) if len(argv) > 1 else 0
+    enable_bonsai()
+    print(f'Worker {os.getpid()} waiting for jobs in {queue_dir}')
+    completed = 0
+    while not os.path.exists(os.path.join(queue_dir, 'stop')):
+        claimed = claim_job(queue_dir)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        run_job(queue_dir, *claimed)
+        completed += 1
+        if max_jobs and completed >= max_jobs:
+            break
+
+
+if __name__ == '__main__':
+    main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
@@ -0,0 +1,104 @@
+import ifcopenshell
+import ifcopenshell.ifcopenshell_wrapper
+import ifcopenshell.util.element
+import ifcpatch
+
+# These may only be used by one product or styled once, so sharing them would produce an invalid model
+UNSHARED = ("IfcRoot", "IfcObjectPlacement", "IfcProductRepresentation", "IfcRepresentation")
+# Material styles follow their material, so they are folded along with it
+SHARED = ("IfcMaterialDefinitionRepresentation", "IfcStyledRepresentation")
+# Significant digits of reals written to STEP, so values that differ only once written and read back are equal
+REAL_DIGITS = 15
+
+
+def get_data_size(ifc_file):
+    """Return the number of entities and the approximate bytes of their STEP lines."""
+    count = 0
+    size = 0
+    for element in ifc_file:
+        count += 1
+        size += len(str(element)) + 2
+    return count, size
+
+
+def is_shareable(ifc_file, element):
+    if any(element.is_a(ifc_class) for ifc_class in SHARED):
+        return True
+    if any(element.is_a(ifc_class) for ifc_class in UNSHARED):
+        return False
+    if element.is_a("IfcRepresentationItem"):
+        for inverse in ifc_file.get_inverse(element):
+            if inverse.is_a("IfcStyledItem") or inverse.is_a("IfcPresentationLayerAssignment"):
+                return False
+    return True
+
+
+def fold_resources(ifc_file):
+    """
+    Replace structurally identical resources with a single instance.
+
+    Entities are compared bottom-up, so two resources are identical when
+    their attributes are equal after their own references have been folded.
+    Reals are compared at the precision STEP stores, and members of SET
+    attributes in any order.
+
+    :return: The number of entities removed.
+    """
+    schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(ifc_file.schema_identifier)
+    attribute_types = {}
+    canonical = {}
+    keys = {}
+
+    def get_canonical(element):
+        if element.id() in canonical:
+            return canonical[element.id()]
+        result = element
+        if is_shareable(ifc_file, element):
+            types = attribute_types.get(element.is_a())
+            if types is None:
+                declaration = schema.declaration_by_name(element.is_a())
+                types = attribute_types[element.is_a()] = [a.type_of_attribute() for a in declaration.all_attributes()]
+            key = (element.is_a(), tuple(get_key(v, t) for v, t in zip(element, types)))
+            result = keys.setdefault(key, element)
+        canonical[element.id()] = result
+        return result
+
+    def get_key(value, value_type=None):
+        if isinstance(value, (list, tuple)):
+            aggregation = value_type.as_aggregation_type() if value_type else None
+            member_type = aggregation.type_of_element() if aggregation else None
+            members = tuple(get_key(v, member_type) for v in value)
+            if aggregation and aggregation.type_of_aggregation_string() == "set":
+                return tuple(sorted(members, key=repr))
+            return members
+        elif isinstance(value, ifcopenshell.entity_instance):
+            if not value.id():
+                return (value.is_a(), get_key(value.wrappedValue))
+            return get_canonical(value).id()
+        elif isinstance(value, float):
+            return float(f"{value:.{REAL_DIGITS}g}")
+        return value
+
+    duplicates = [element for element in ifc_file if get_canonical(element) != element]
+    for element in duplicates:
+        ifcopenshell.util.element.replace_element(element, canonical[element.id()])
+    for element in duplicates:
+        ifc_file.remove(element)
+    return len(duplicates)
+
+
+def dedupe_resources(ifc_file):
+    """
+    Consolidate identical resources left behind by merging.
+
+    Element types sharing a GlobalId are merged first, then units, contexts,
+    styles, materials, points, directions and other resources are folded so
+    that every merged file shares one copy of each.
+
+    :return: The entities and approximate bytes saved.
+    """
+    count, size = get_data_size(ifc_file)
+    ifcpatch.execute({"file": ifc_file, "recipe": "MergeDuplicateTypes", "arguments": ["GlobalId"]})
+    fold_resources(ifc_file)
+    new_count, new_size = get_data_size(ifc_file)
+    return count - new_count, size - new_size
@@ -0,0 +1,199 @@
+import itertools
+import json
+import os
+import sqlite3
+
+import ifcopenshell
+import ifcopenshell.geom
+import ifcopenshell.util.attribute
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
+import ifcopenshell.util.representation
+import ifcopenshell.util.schema
+import ifcopenshell.util.shape
+import ifcopenshell.util.unit
+import numpy as np
+
+GEOMETRY = "INSERT INTO geometry VALUES (?, ?, ?, ?, ?, ?);"
+# Rows are inserted in chunks of this size, so no table is held in memory at once
+CHUNK_SIZE = 10000
+
+
+def is_sqlite_path(path):
+    return path.lower().endswith((".ifcsqlite", ".sqlite", ".db"))
+
+
+def get_column_type(attribute):
+    primitive = ifcopenshell.util.attribute.get_primitive_type(attribute)
+    if primitive in ("entity", "integer", "boolean"):
+        return "INTEGER"
+    elif primitive == "float":
+        return "REAL"
+    elif isinstance(primitive, tuple):
+        return "JSON"
+    return "TEXT"
+
+
+def serialise_value(element, value):
+    return element.walk(
+        lambda v: isinstance(v, ifcopenshell.entity_instance),
+        lambda v: v.id() if v.id() else {"type": v.is_a(), "value": v.wrappedValue},
+        value,
+    )
+
+
+def get_row(ifc_file, element):
+    row = [element.id()]
+    for value in element:
+        if isinstance(value, ifcopenshell.entity_instance):
+            row.append(value.id() if value.id() else json.dumps({"type": value.is_a(), "value": value.wrappedValue}))
+        elif isinstance(value, tuple):
+            row.append(json.dumps(serialise_value(element, value)))
+        else:
+            row.append(value)
+    row.append(json.dumps([inverse.id() for inverse in ifc_file.get_inverse(element)]))
+    return row
+
+
+def insert_chunks(cursor, statement, rows):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, CHUNK_SIZE)):
+        cursor.executemany(statement, chunk)
+
+
+def create_tables(cursor, ifc_file):
+    cursor.execute("CREATE TABLE id_map (ifc_id integer PRIMARY KEY NOT NULL UNIQUE, ifc_class text);")
+    cursor.execute("CREATE TABLE metadata (preprocessor text, schema text, mvd text);")
+    cursor.execute("CREATE TABLE psets (ifc_id integer NOT NULL, pset_name text, name text, value text);")
+    cursor.execute("CREATE TABLE shape (ifc_id integer NOT NULL, x real, y real, z real, matrix blob, geometry text);")
+    cursor.execute(
+        "CREATE TABLE geometry (id text NOT NULL, verts blob, edges blob, faces blob, material_ids blob, materials json);"
+    )
+    # The same convention as the Ifc2Sql recipe, with one table per class
+    description = ifc_file.header.file_description.description
+    cursor.execute(
+        "INSERT INTO metadata VALUES (?, ?, ?);",
+        ("IfcOpenShell-1.0.0", ifc_file.schema, description[0] if description else ""),
+    )
+
+
+def insert_class(cursor, ifc_file, ifc_class):
+    declaration = ifcopenshell.schema_by_name(ifc_file.schema_identifier).declaration_by_name(ifc_class)
+    columns = ["ifc_id INTEGER PRIMARY KEY NOT NULL UNIQUE"]
+    columns.extend(f"`{a.name()}` {get_column_type(a)}" for a in declaration.all_attributes())
+    columns.append("inverses JSON")
+    cursor.execute(f"CREATE TABLE {ifc_class} ({', '.join(columns)});")
+
+    elements = ifc_file.by_type(ifc_class, include_subtypes=False)
+    placeholders = ",".join(["?"] * len(columns))
+    insert_chunks(cursor, f"INSERT INTO {ifc_class} VALUES ({placeholders});", (get_row(ifc_file, e) for e in elements))
+    insert_chunks(cursor, "INSERT INTO id_map VALUES (?, ?);", ((e.id(), ifc_class) for e in elements))
+    if ifcopenshell.util.schema.is_a(declaration, "IfcObjectDefinition"):
+        insert_chunks(cursor, "INSERT INTO psets VALUES (?, ?, ?, ?);", get_pset_rows(elements))
+
+
+def get_pset_rows(elements):
+    for element in elements:
+        for pset_name, pset_data in ifcopenshell.util.element.get_psets(element).items():
+            for name, value in pset_data.items():
+                if name == "id":
+                    continue
+                yield element.id(), pset_name, name, json.dumps(value) if isinstance(value, list) else value
+
+
+def get_geometry_row(geometry_id, geometry):
+    materials = json.dumps([m.instance_id() for m in geometry.materials])
+    return (
+        geometry_id,
+        geometry.verts_buffer,
+        geometry.edges_buffer,
+        geometry.faces_buffer,
+        geometry.material_ids_buffer,
+        materials,
+    )
+
+
+def insert_geometry(cursor, ifc_file):
+    """Tessellate the body of each element and type into the shape and geometry tables Bonsai loads."""
+    unit_scale = ifcopenshell.util.unit.calculate_unit_scale(ifc_file)
+    settings = ifcopenshell.geom.settings()
+    settings.set("apply-default-materials", False)
+    contexts = [
+        c.id()
+        for c in ifc_file.by_type("IfcGeometricRepresentationSubContext")
+        if c.ContextIdentifier in ("Body", "Facetation")
+    ]
+    contexts.extend(
+        c.id()
+        for c in ifc_file.by_type("IfcGeometricRepresentationContext", include_subtypes=False)
+        if c.ContextType == "Model"
+    )
+    settings.set("context-ids", contexts)
+
+    elements = ifc_file.by_type("IfcElement")
+    if ifc_file.schema in ("IFC2X3", "IFC4"):
+        elements += ifc_file.by_type("IfcProxy")
+    shapes = {}
+    geometries = set()
+    if elements:
+        iterator = ifcopenshell.geom.iterator(settings, ifc_file, os.cpu_count(), include=elements)
+        if iterator.initialize():
+            while True:
+                shape = iterator.get()
+                if shape.geometry.id not in geometries:
+                    geometries.add(shape.geometry.id)
+                    cursor.execute(GEOMETRY, get_geometry_row(shape.geometry.id, shape.geometry))
+                matrix = ifcopenshell.util.shape.get_shape_matrix(shape).copy()
+                matrix[:3, 3] /= unit_scale
+                shapes[shape.id] = (shape.id, *matrix[:3, 3].tolist(), matrix.tobytes(), shape.geometry.id)
+                if not iterator.next():
+                    break
+    for element in elements:
+        if element.id() not in shapes and element.ObjectPlacement:
+            matrix = ifcopenshell.util.placement.get_local_placement(element.ObjectPlacement)
+            shapes[element.id()] = (element.id(), *matrix[:3, 3].tolist(), matrix.tobytes(), None)
+
+    identity = np.eye(4, dtype=np.float64).tobytes()
+    body_contexts = [ifc_file.by_id(i) for i in contexts]
+    for element_type in ifc_file.by_type("IfcElementType"):
+        geometry_id = None
+        for context in body_contexts:
+            if representation := ifcopenshell.util.representation.get_representation(element_type, context):
+                geometry_id = str(representation.id())
+                if geometry_id not in geometries:
+                    geometry = ifcopenshell.geom.create_shape(settings, representation)
+                    geometries.add(geometry_id)
+                    cursor.execute(GEOMETRY, get_geometry_row(geometry_id, geometry))
+                break
+        shapes[element_type.id()] = (element_type.id(), 0.0, 0.0, 0.0, identity, geometry_id)
+    insert_chunks(cursor, "INSERT INTO shape VALUES (?, ?, ?, ?, ?, ?);", shapes.values())
+
+
+def write_sqlite(ifc_file, path, geometry=True):
+    """
+    Write a model to an IfcSQLite database, in the layout of the Ifc2Sql recipe that Bonsai loads.
+
+    Rows are inserted in chunks within a single transaction, into a database
+    beside the output that replaces it once committed. An interrupted write
+    never leaves a partial database at the output path.
+    """
+    partial_path = f"{path}.partial"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    db = sqlite3.connect(partial_path, isolation_level=None)
+    try:
+        # The database is renamed into place once committed, so a journal is not needed
+        db.execute("PRAGMA journal_mode = OFF;")
+        db.execute("PRAGMA synchronous = OFF;")
+        cursor = db.cursor()
+        cursor.execute("BEGIN;")
+        create_tables(cursor, ifc_file)
+        for ifc_class in ifc_file.wrapped_data.types():
+            insert_class(cursor, ifc_file, ifc_class)
+        if geometry:
+            insert_geometry(cursor, ifc_file)
+        cursor.execute("COMMIT;")
+    finally:
+        db.close()
+    os.replace(partial_path, path)
@@ -2,12 +2,36 @@ import ifcpatch
 import ifcopenshell
 import click
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dedupe import dedupe_resources
+from ifcsqlite import is_sqlite_path, write_sqlite
+from report import MergeReport
+from stream import StreamMergeError, stream_merge
+from tree import merge_tree
+
+
+def load_models(paths, jobs=None):
+    """
+    Parse IFC files concurrently and return the opened models in input order.
+
+    Parsing releases the GIL, so threads parse several STEP files at once while
+    keeping the models in this process for the merge.
+    """
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        return list(executor.map(ifcopenshell.open, paths))
 
 
 @click.command()
 @click.argument("input_files", nargs=-1, type=click.Path(exists=True))
-@click.option("--output", "-o", required=True, type=click.Path(), help="Path to save merged IFC file.")
-def merge_ifc(input_files, output):
+@click.option(
+    "--output", "-o", required=True, type=click.Path(), help="Path to save merged IFC file, as .ifc, .ifczip or .ifcsqlite."
+)
+@click.option("--jobs", "-j", default=0, type=int, help="Number of files to parse at once (default: CPU count).")
+@click.option("--stream", is_flag=True, help="Rewrite STEP data straight to the output without loading models.")
+@click.option("--dedupe", is_flag=True, help="Consolidate identical resources after merging.")
+@click.option("--tree", is_flag=True, help="Merge pairs of files in parallel processes, level by level.")
+def merge_ifc(input_files, output, jobs, stream, dedupe, tree):
     """
     Merge multiple IFC files into a single IFC file using ifcpatch MergeProjects.
     """
@@ -20,36 +44,102 @@ def merge_ifc(input_files, output):
         click.echo("❌ At least 2 IFC files are required for merging.")
         return
 
+    if stream and tree:
+        click.echo("❌ --stream and --tree cannot be used together.")
+        return
+
     click.echo(f"🔄 Merging {len(input_files)} IFC files using ifcpatch...")
 
     # Use the last file as the base
     base_file_path = input_files[-1]
     click.echo(f"📁 Using {os.path.basename(base_file_path)} as base file")
 
-    ifc_file = ifcopenshell.open(base_file_path)
+    report = MergeReport(output, "stream" if stream else "tree" if tree else "merge")
+
+    if stream:
+        start = time.perf_counter()
+        # A database is written from the model, so the STEP data is streamed beside it first
+        streamed_output = f"{output}.ifc" if is_sqlite_path(output) else output
+        try:
+            with report.phase("stream"):
+                total = stream_merge(
+                    base_file_path,
+                    input_files[:-1],
+                    streamed_output,
+                    on_file=lambda path, count: click.echo(f"📄 Streamed {count} entities from {os.path.basename(path)}"),
+                    report=report,
+                )
+        except StreamMergeError as e:
+            click.echo(f"❌ {e}")
+            return
+        click.echo(f"✅ Merged IFC saved as: {streamed_output}")
+        click.echo(f"📊 Total entities in merged file: {total} ({time.perf_counter() - start:.2f}s)")
+        if not dedupe and streamed_output == output:
+            click.echo(f"📝 Merge report saved as: {report.write()}")
+            return
+        # Deduplicating and writing a database need the merged model in memory
+        with report.phase("load"):
+            ifc_file = ifcopenshell.open(streamed_output)
+        if streamed_output != output:
+            os.remove(streamed_output)
+    elif tree:
+        start = time.perf_counter()
+
+        def on_level(level, pairs, seconds):
+            report.phases[f"level_{level}"] = seconds
+            click.echo(f"🌲 Level {level}: merged {pairs} {'pair' if pairs == 1 else 'pairs'} in {seconds:.2f}s")
 
-    # Merge other files in reverse order (excluding the last one)
-    files_to_merge = list(input_files)
+        with report.phase("merge"):
+            ifc_file = merge_tree(input_files, jobs, on_level=on_level, report=report)
+        click.echo(f"🌲 Merged {len(input_files)} IFC files in {time.perf_counter() - start:.2f}s")
+    else:
+        start = time.perf_counter()
+        with report.phase("load"):
+            models = load_models(input_files, jobs)
+            for i, (path, model) in enumerate(zip(input_files, models)):
+                report.add_model(i, path, model)
+        click.echo(f"📂 Parsed {len(models)} IFC files in {time.perf_counter() - start:.2f}s")
 
-    ifc_file = ifcpatch.execute({
-        "input": "input.ifc",  # This is just a placeholder name
-        "file": ifc_file,
-        "recipe": "MergeProjects",
-        "arguments": [files_to_merge],
-    })
+        # Merge the other files into the base, which is already open
+        ifc_file = models[-1]
+        files_to_merge = models[:-1]
+
+        with report.phase("merge"):
+            ifc_file = ifcpatch.execute({
+                "input": "input.ifc",  # This is just a placeholder name
+                "file": ifc_file,
+                "recipe": "MergeProjects",
+                "arguments": [files_to_merge],
+            })
+
+    if dedupe:
+        start = time.perf_counter()
+        with report.phase("dedupe"):
+            entities, size = dedupe_resources(ifc_file)
+        report.dedupe = {"entities": entities, "bytes": size}
+        click.echo(
+            f"🧹 Removed {entities} duplicate entities, saving about {size / 1024:.1f} KB "
+            f"({time.perf_counter() - start:.2f}s)"
+        )
 
     # Write the final merged file
     try:
-        ifc_file.write(output)
+        with report.phase("write"):
+            if is_sqlite_path(output):
+                write_sqlite(ifc_file, output)
+            else:
+                ifc_file.write(output)
         click.echo(f"✅ Merged IFC saved as: {output}")
 
-        # Show some stats
-        products = ifc_file.by_type("IfcProduct")
-        click.echo(f"📊 Total products in merged file: {len(products)}")
+        # Show some stats, counted while the sources were read
+        click.echo(
+            f"📊 Merged {report.get_total()} entities from {len(report.sources)} files, "
+            f"{report.guid_collisions} GlobalIds found in more than one file"
+        )
+        click.echo(f"📝 Merge report saved as: {report.write()}")
 
     except Exception as e:
         click.echo(f"❌ Failed to write merged file: {e}")
 
-
 if __name__ == "__main__":
     merge_ifc()
@@ -0,0 +1,103 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import ifcopenshell.ifcopenshell_wrapper
+
+
+def get_report_path(output):
+    return os.path.splitext(output)[0] + ".report.json"
+
+
+def get_model_classes(ifc_file):
+    """Count the entities of each class from the model's class index, without visiting entities."""
+    return {ifc_class: len(ifc_file.by_type(ifc_class, include_subtypes=False)) for ifc_class in ifc_file.wrapped_data.types()}
+
+
+def get_model_guids(ifc_file):
+    return [element.GlobalId for element in ifc_file.by_type("IfcRoot")]
+
+
+class SchemaClasses:
+    """Resolve upper case STEP class names to schema class names, and whether they are rooted."""
+
+    def __init__(self, schema):
+        self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema)
+        self.names = {}
+        self.rooted = {}
+
+    def get_name(self, step_class):
+        if step_class not in self.names:
+            declaration = self.schema.declaration_by_name(step_class)
+            self.names[step_class] = declaration.name()
+            rooted = False
+            while declaration:
+                if declaration.name() == "IfcRoot":
+                    rooted = True
+                    break
+                declaration = declaration.supertype()
+            self.rooted[step_class] = rooted
+        return self.names[step_class]
+
+    def is_rooted(self, step_class):
+        self.get_name(step_class)
+        return self.rooted[step_class]
+
+
+class MergeReport:
+    """
+    Statistics gathered while merging, so that nothing walks the merged model afterwards.
+
+    Sources are counted as they are read and keyed by their position in the
+    inputs, so a file given twice is two sources. GlobalIds shared by more
+    than one source are counted as collisions, and each phase is timed.
+    """
+
+    def __init__(self, output, mode):
+        self.output = output
+        self.mode = mode
+        self.sources = {}
+        self.guids = {}
+        self.guid_collisions = 0
+        self.phases = {}
+        self.dedupe = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_source(self, index, path, classes, guids):
+        self.sources[index] = {"path": path, "entities": sum(classes.values()), "classes": dict(sorted(classes.items()))}
+        for guid in guids:
+            if self.guids.setdefault(guid, index) != index:
+                self.guid_collisions += 1
+
+    def add_model(self, index, path, ifc_file):
+        self.add_source(index, path, get_model_classes(ifc_file), get_model_guids(ifc_file))
+
+    def get_total(self):
+        return sum(source["entities"] for source in self.sources.values())
+
+    def to_dict(self):
+        report = {
+            "output": self.output,
+            "mode": self.mode,
+            "bytes_written": os.path.getsize(self.output) if os.path.exists(self.output) else 0,
+            "sources": [self.sources[index] for index in sorted(self.sources)],
+            "guid_collisions": self.guid_collisions,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+        }
+        if self.dedupe:
+            report["dedupe"] = self.dedupe
+        return report
+
+    def write(self, path=None):
+        path = path or get_report_path(self.output)
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(self.to_dict(), report_file, indent=4)
+        return path
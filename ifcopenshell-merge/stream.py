@@ -0,0 +1,279 @@
+import io
+import os
+import re
+import zipfile
+from contextlib import contextmanager
+
+from report import SchemaClasses
+
+ENTITY = re.compile(r"#(\d+)\s*=\s*([A-Za-z0-9_]+)\s*\(")
+# Strings are matched first so that references inside them are left alone.
+REFERENCE = re.compile(r"'(?:[^']|'')*'|#(\d+)")
+CONTEXTS = ("IFCGEOMETRICREPRESENTATIONCONTEXT", "IFCGEOMETRICREPRESENTATIONSUBCONTEXT")
+UNITS = (
+    "IFCSIUNIT",
+    "IFCCONVERSIONBASEDUNIT",
+    "IFCCONVERSIONBASEDUNITWITHOFFSET",
+    "IFCDERIVEDUNIT",
+    "IFCDERIVEDUNITELEMENT",
+    "IFCMONETARYUNIT",
+)
+SHARED = ("IFCPROJECT", "IFCOWNERHISTORY", "IFCUNITASSIGNMENT") + CONTEXTS + UNITS
+
+
+class StreamMergeError(Exception):
+    pass
+
+
+def read_statements(path):
+    """
+    Yield the header and data statements of a STEP file as ("header" | "data", statement).
+
+    Statements may span several lines. Lines are read one at a time, so
+    memory use does not grow with the file size.
+    """
+    section = "header"
+    statement = ""
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as step_file:
+        for line in step_file:
+            statement += line
+            # A statement ends at a semicolon outside of a string. Quotes are escaped by doubling them.
+            if not line.rstrip().endswith(";") or statement.count("'") % 2:
+                continue
+            statement = statement.strip()
+            if statement == "DATA;":
+                section = "data"
+            elif section == "data" and statement == "ENDSEC;":
+                section = "footer"
+            elif statement and section != "footer":
+                yield section, statement
+            statement = ""
+
+
+def split_attributes(statement):
+    """Split the top level attributes of an entity statement such as #1=IFCPROJECT('a',$,(#2,#3))."""
+    body = statement[statement.index("(") + 1 : statement.rindex(")")]
+    attributes = []
+    depth = 0
+    in_string = False
+    start = 0
+    for i, char in enumerate(body):
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            attributes.append(body[start:i].strip())
+            start = i + 1
+    attributes.append(body[start:].strip())
+    return attributes
+
+
+def scan(path):
+    """
+    Read the schema, the largest entity ID and the entities shared between models in one pass.
+
+    :return: A dict with "schema", "max_id" and "entities", a dict of
+        entity ID to (type, statement) for the shared entity types.
+    """
+    schema = None
+    max_id = 0
+    entities = {}
+    for section, statement in read_statements(path):
+        if section == "header":
+            if statement.upper().startswith("FILE_SCHEMA"):
+                schema = re.sub(r"\s", "", statement.upper())
+            continue
+        match = ENTITY.match(statement)
+        if not match:
+            continue
+        step_id = int(match.group(1))
+        max_id = max(max_id, step_id)
+        ifc_class = match.group(2).upper()
+        if ifc_class in SHARED:
+            entities[step_id] = (ifc_class, statement)
+    return {"schema": schema, "max_id": max_id, "entities": entities}
+
+
+def get_ids(model, ifc_class):
+    return [step_id for step_id, (entity_class, _) in model["entities"].items() if entity_class == ifc_class]
+
+
+def get_unit(model, step_id):
+    """Return the type of a unit and a description that compares equal for the same unit in two models."""
+    ifc_class, statement = model["entities"].get(step_id, (None, None))
+    if ifc_class not in UNITS:
+        return None, None
+    attributes = split_attributes(statement)
+    if ifc_class == "IFCSIUNIT":
+        return attributes[1], (ifc_class, attributes[2], attributes[3])
+    elif ifc_class == "IFCMONETARYUNIT":
+        return ".MONETARYUNIT.", (ifc_class, attributes[0])
+    elif ifc_class == "IFCDERIVEDUNIT":
+        elements = []
+        for element_id in re.findall(r"#(\d+)", attributes[0]):
+            unit_id, exponent = split_attributes(model["entities"][int(element_id)][1])
+            elements.append((get_unit(model, int(unit_id.lstrip("#")))[1], exponent))
+        unit_type = attributes[2] if attributes[1] == ".USERDEFINED." else attributes[1]
+        return unit_type, (ifc_class, tuple(sorted(elements, key=repr)))
+    return attributes[1], (ifc_class, attributes[2])
+
+
+def get_units(model):
+    """Return the units assigned to the project, as a dict of unit type to a comparable description."""
+    units = {}
+    for step_id in get_ids(model, "IFCUNITASSIGNMENT"):
+        statement = model["entities"][step_id][1]
+        for unit_id in re.findall(r"#(\d+)", statement):
+            unit_type, unit = get_unit(model, int(unit_id))
+            if unit_type:
+                units[unit_type] = unit
+    return units
+
+
+def get_context_key(model, step_id):
+    """Describe a representation context so that equivalent contexts of two models compare equal."""
+    ifc_class, statement = model["entities"][step_id]
+    attributes = split_attributes(statement)
+    if ifc_class == "IFCGEOMETRICREPRESENTATIONSUBCONTEXT":
+        return (ifc_class, attributes[0], attributes[1], attributes[8])
+    return (ifc_class, attributes[0], attributes[1])
+
+
+def get_shared_mapping(base, model):
+    """
+    Map the project, unit assignment, owner histories and equivalent contexts of a model onto the base.
+
+    Mapped entities are not written, and references to them point to the
+    base entities instead.
+    """
+    mapping = {}
+    for ifc_class in ("IFCPROJECT", "IFCUNITASSIGNMENT"):
+        base_ids = get_ids(base, ifc_class)
+        if base_ids:
+            for step_id in get_ids(model, ifc_class):
+                mapping[step_id] = base_ids[0]
+    base_owner_histories = get_ids(base, "IFCOWNERHISTORY")
+    if base_owner_histories:
+        for step_id in get_ids(model, "IFCOWNERHISTORY"):
+            mapping[step_id] = base_owner_histories[0]
+    base_contexts = {}
+    for ifc_class in CONTEXTS:
+        for step_id in get_ids(base, ifc_class):
+            base_contexts.setdefault(get_context_key(base, step_id), step_id)
+    for ifc_class in CONTEXTS:
+        for step_id in get_ids(model, ifc_class):
+            context_id = base_contexts.get(get_context_key(model, step_id))
+            if context_id:
+                mapping[step_id] = context_id
+    return mapping
+
+
+@contextmanager
+def open_output(output):
+    """
+    Open the output for writing STEP text, compressing it into an archive if it is an .ifczip.
+
+    Text is written beside the output and replaces it once complete, so an
+    interrupted merge never leaves a truncated output.
+    """
+    partial_path = f"{output}.partial"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    if not output.lower().endswith(".ifczip"):
+        with open(partial_path, "w", encoding="utf-8", errors="surrogateescape", newline="\n") as output_file:
+            yield output_file
+    else:
+        name = os.path.splitext(os.path.basename(output))[0] + ".ifc"
+        with zipfile.ZipFile(partial_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(name, "w", force_zip64=True) as entry:
+                with io.TextIOWrapper(entry, encoding="utf-8", errors="surrogateescape", newline="\n") as output_file:
+                    yield output_file
+    os.replace(partial_path, output)
+
+
+def check_models(base, paths):
+    """
+    Scan the other files and check that their schema and units match the base.
+
+    :return: The scans of the other files, in order.
+    :raises StreamMergeError: If a file would need converting to merge into the base.
+    """
+    base_units = get_units(base)
+    models = []
+    for path in paths:
+        model = scan(path)
+        if model["schema"] != base["schema"]:
+            raise StreamMergeError(f"{path} has schema {model['schema']} but the base has {base['schema']}")
+        units = get_units(model)
+        unit_types = sorted(t for t in base_units.keys() | units.keys() if base_units.get(t) != units.get(t))
+        if unit_types:
+            unit_types = ", ".join(t.strip(".").lower() for t in unit_types)
+            raise StreamMergeError(f"{path} has different units to the base ({unit_types}), merge it without streaming")
+        models.append(model)
+    return models
+
+
+def stream_merge(base_path, paths, output, on_file=None, report=None):
+    """
+    Merge IFC files into the base by rewriting their STEP data, without loading any model.
+
+    The base is written unchanged. Other files follow with entity IDs offset
+    past the highest ID written so far. Their IfcProject, IfcUnitAssignment,
+    IfcOwnerHistory and equivalent representation contexts are replaced by
+    those of the base. Unlike MergeProjects, units and georeferencing are
+    not converted, so every file is checked before anything is written and
+    files with any unit different to the base are rejected. An .ifczip
+    output is compressed as it is written.
+
+    :param on_file: Called with each path and the number of entities written from it.
+    :param report: A MergeReport to count the classes and GlobalIds of each file in as it is read.
+        Sources are numbered in input order with the base last, as main.py passes them.
+    :return: The number of entities written.
+    """
+    base = scan(base_path)
+    models = [base] + check_models(base, paths)
+    schema_classes = SchemaClasses(re.search(r"'([^']+)'", base["schema"]).group(1)) if report else None
+    total = 0
+    offset = 0
+    with open_output(output) as merged_file:
+        for i, (path, model) in enumerate(zip([base_path] + list(paths), models)):
+            mapping = get_shared_mapping(base, model) if i else {}
+
+            def rewrite(match):
+                if match.group(1) is None:
+                    return match.group(0)
+                step_id = int(match.group(1))
+                return f"#{mapping.get(step_id, step_id + offset)}"
+
+            count = 0
+            classes = {}
+            guids = []
+            for section, statement in read_statements(path):
+                if section == "header":
+                    if i == 0:
+                        merged_file.write(statement + "\n")
+                    continue
+                if i == 0 and count == 0:
+                    merged_file.write("DATA;\n")
+                match = ENTITY.match(statement)
+                if match and report:
+                    ifc_class = schema_classes.get_name(match.group(2).upper())
+                    classes[ifc_class] = classes.get(ifc_class, 0) + 1
+                    if schema_classes.is_rooted(match.group(2).upper()):
+                        guids.append(statement[match.end() :].split(",", 1)[0].strip().strip("'"))
+                if match and int(match.group(1)) in mapping:
+                    continue
+                merged_file.write((REFERENCE.sub(rewrite, statement) if offset else statement) + "\n")
+                count += 1
+            total += count
+            offset += model["max_id"]
+            if report:
+                report.add_source(i - 1 if i else len(models) - 1, path, classes, guids)
+            if on_file:
+                on_file(path, count)
+        merged_file.write("ENDSEC;\nEND-ISO-10303-21;\n")
+    return total
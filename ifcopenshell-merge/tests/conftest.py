@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules are imported from the directory above, as main.py does.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
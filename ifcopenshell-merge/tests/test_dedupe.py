@@ -0,0 +1,36 @@
+import os
+import ifcopenshell
+from click.testing import CliRunner
+from dedupe import fold_resources
+from main import merge_ifc
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "data", "ifc")
+
+
+def merge(tmp_path, *args):
+    inputs = [os.path.join(DATA, name) for name in ("test1.ifc", "test2.ifc") * 2 + ("test1.ifc",)]
+    output = str(tmp_path / "merged.ifc")
+    result = CliRunner().invoke(merge_ifc, [*inputs, "-o", output, *args])
+    assert result.exit_code == 0, result.output
+    return len(list(ifcopenshell.open(output)))
+
+
+def test_tree_dedupe_matches_dedupe(tmp_path):
+    assert merge(tmp_path, "--tree", "--dedupe") == merge(tmp_path, "--dedupe")
+
+
+def test_fold_reals_at_step_precision():
+    ifc_file = ifcopenshell.file(schema="IFC4")
+    ifc_file.createIfcColourRgb(None, 0.1 + 0.2, 0.5, 0.5)
+    ifc_file.createIfcColourRgb(None, 0.3, 0.5, 0.5)
+    assert fold_resources(ifc_file) == 1
+
+
+def test_fold_sets_in_any_order():
+    ifc_file = ifcopenshell.file(schema="IFC4")
+    metre = ifc_file.createIfcSIUnit(None, "LENGTHUNIT", None, "METRE")
+    radian = ifc_file.createIfcSIUnit(None, "PLANEANGLEUNIT", None, "RADIAN")
+    ifc_file.createIfcUnitAssignment((metre, radian))
+    ifc_file.createIfcUnitAssignment((radian, metre))
+    assert fold_resources(ifc_file) == 1
+    assert len(ifc_file.by_type("IfcUnitAssignment")) == 1
@@ -0,0 +1,86 @@
+import ifcopenshell
+import ifcpatch
+from report import get_model_classes, get_model_guids
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def merge_pair(path_a, path_b, indices=(None, None)):
+    """
+    Merge the file at path_a into the file at path_b, keeping the project of path_b like a sequential merge.
+
+    :param indices: The input positions of path_a and path_b to count the classes and GlobalIds of
+        before they are merged, or None for files that are not inputs.
+    :return: The merged model, and a dict of input position to (classes, GlobalIds).
+    """
+    ifc_file = ifcopenshell.open(path_b)
+    other = ifcopenshell.open(path_a)
+    stats = {}
+    for index, model in zip(indices, (other, ifc_file)):
+        if index is not None:
+            stats[index] = (get_model_classes(model), get_model_guids(model))
+    ifc_file = ifcpatch.execute({
+        "input": path_b,
+        "file": ifc_file,
+        "recipe": "MergeProjects",
+        "arguments": [[other]],
+    })
+    return ifc_file, stats
+
+
+def merge_pair_to_file(path_a, path_b, output, indices=(None, None)):
+    ifc_file, stats = merge_pair(path_a, path_b, indices)
+    ifc_file.write(output)
+    return output, stats
+
+
+def merge_tree(paths, jobs=None, on_level=None, report=None):
+    """
+    Merge IFC files pairwise in a balanced binary tree.
+
+    Each level merges neighbouring files in separate processes, so no merge
+    grows one model by every input in turn. The right file of each pair is
+    the base, so the result keeps the project and units of the last file, as
+    a sequential merge into the last file does. Intermediate levels are
+    written to a temporary directory and the final pair is merged in this
+    process.
+
+    :param on_level: Called with the level number, the number of pairs merged and the seconds taken.
+    :param report: A MergeReport to count each input in as the process merging it opens it.
+    :return: The merged model.
+    """
+    # Each file is paired with its input position, or None once it is an intermediate merge
+    level = [(i if report else None, path) for i, path in enumerate(paths)]
+    stats = {}
+    depth = 0
+    with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        while len(level) > 2:
+            depth += 1
+            start = time.perf_counter()
+            futures = []
+            for i in range(0, len(level) - 1, 2):
+                output = os.path.join(directory, f"level-{depth}-{i // 2}.ifc")
+                (index_a, path_a), (index_b, path_b) = level[i], level[i + 1]
+                futures.append(executor.submit(merge_pair_to_file, path_a, path_b, output, (index_a, index_b)))
+            merged = []
+            for future in futures:
+                merged_path, pair_stats = future.result()
+                merged.append((None, merged_path))
+                stats.update(pair_stats)
+            if len(level) % 2:
+                merged.append(level[-1])
+            if on_level:
+                on_level(depth, len(futures), time.perf_counter() - start)
+            level = merged
+        start = time.perf_counter()
+        (index_a, path_a), (index_b, path_b) = level
+        ifc_file, pair_stats = merge_pair(path_a, path_b, (index_a, index_b))
+        stats.update(pair_stats)
+        if on_level:
+            on_level(depth + 1, 1, time.perf_counter() - start)
+    for i, path in enumerate(paths):
+        if i in stats:
+            report.add_source(i, path, *stats[i])
+    return ifc_file